@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import website.main  # noqa: F401 imported before website.core.database, which imports crud, which needs the models loaded
+from website.core.database import Base, set_sqlite_pragmas
+from website.core.refdata import reference_data
+
+
+class Database:
+    def __init__(
+            self,
+            url: str,
+    ):
+        self.url = url
+        self.statements: list[str] = []
+
+    def run(
+            self,
+            check,
+    ):
+        # check(session_factory) runs on a fresh loop with its own engine, so nothing pooled outlives the test
+        async def main():
+            engine = create_async_engine(self.url, future=True)
+            event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+            event.listen(engine.sync_engine, "before_cursor_execute",
+                         lambda conn, cursor, statement, *args: self.statements.append(statement))
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            reference_data.invalidate()  # the cache is process-wide, so drop whatever an earlier test loaded
+            try:
+                return await check(sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    def count(
+            self,
+            prefix: str = '',
+    ) -> int:
+        return sum(1 for statement in self.statements if statement.lstrip().upper().startswith(prefix))
+
+
+@pytest.fixture
+def database(tmp_path) -> Database:
+    return Database(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
@@ -0,0 +1,82 @@
+import contextlib
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+BOUND_SECONDS = 5
+STARTUP_SECONDS = 30  # workers starting together queue for the database's startup lock
+
+
+def fetch(
+        url: str,
+        data: dict = None,
+        headers: dict = None,
+        form: bool = False,
+):
+    body = None
+    headers = dict(headers or {})
+    if data is not None and form:
+        body = urllib.parse.urlencode(data).encode()
+    elif data is not None:
+        body = json.dumps(data).encode()
+        headers['Content-Type'] = 'application/json'
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=BOUND_SECONDS) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as error:
+        return error.code, None
+    except urllib.error.URLError:
+        return None, None  # not listening yet
+
+
+def wait_for(
+        check,
+        seconds: float = BOUND_SECONDS,
+) -> bool:
+    deadline = time.monotonic() + seconds
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def start_workers(
+        directory: pathlib.Path,
+        count: int,
+        settings: dict,
+):
+    # all at once, the way a process manager starts them; yields their base urls once every one is ready
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([str(ROOT), *filter(None, [os.environ.get('PYTHONPATH')])])}
+    overrides = [f"{name}={value!r}" for name, value in settings.items()]
+    urls = []
+    workers = []
+    try:
+        for _ in range(count):
+            port = free_port()
+            workers.append(subprocess.Popen([sys.executable, str(ROOT / 'tests' / 'worker.py'), str(port), *overrides], cwd=directory, env=env,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            urls.append(f"http://127.0.0.1:{port}")
+        for worker, url in zip(workers, urls):
+            assert wait_for(lambda: worker.poll() is not None or fetch(f"{url}/api/ready")[0] == 200, STARTUP_SECONDS)
+            assert worker.poll() is None, "worker exited during startup"
+        yield urls
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait(BOUND_SECONDS)
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+
+class RespServer:
+    # a Redis stand-in with just the commands RedisBackend uses, served from its own thread
+    def __init__(self):
+        self.store: dict[bytes, tuple[bytes, float]] = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = None
+        self.writers = set()
+        self.port = self.call(self._listen(0))
+        self.url = f"redis://127.0.0.1:{self.port}/0"
+
+    def call(
+            self,
+            coroutine,
+    ):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def pause(self):
+        self.call(self._close())
+
+    def resume(self):
+        self.call(self._listen(self.port))
+
+    def stop(self):
+        self.pause()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def expire(
+            self,
+            prefix: str,
+    ):
+        async def expire():
+            for key in [key for key in self.store if key.startswith(prefix.encode())]:
+                del self.store[key]
+
+        self.call(expire())
+
+    async def _listen(
+            self,
+            port: int,
+    ) -> int:
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _close(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    def _get(
+            self,
+            key: bytes,
+    ):
+        value, expires = self.store.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            del self.store[key]
+            return None
+        return value
+
+    async def _handle(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+    ):
+        self.writers.add(writer)
+        try:
+            while line := await reader.readline():
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args[0].upper(), args[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def _execute(
+            self,
+            command: bytes,
+            args: list[bytes],
+    ) -> bytes:
+        if command == b'GET':
+            return bulk(self._get(args[0]))
+        if command == b'MGET':
+            return b'*%d\r\n' % len(args) + b''.join(bulk(self._get(key)) for key in args)
+        if command == b'SET':
+            expires = time.time() + int(args[3]) if len(args) > 3 and args[2].upper() == b'EX' else None
+            self.store[args[0]] = (args[1], expires)
+            return b'+OK\r\n'
+        if command in (b'INCR', b'INCRBY'):
+            value = int(self._get(args[0]) or 0) + (int(args[1]) if len(args) > 1 else 1)
+            self.store[args[0]] = (str(value).encode(), None)
+            return b':%d\r\n' % value
+        if command == b'PING':
+            return b'+PONG\r\n'
+        return b'+OK\r\n'  # connection setup
+
+
+def bulk(value) -> bytes:
+    return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
@@ -0,0 +1,116 @@
+import datetime
+
+from sqlalchemy import func, select
+
+from website.core import crud, models, schemas
+from website.core.migrations import migrate
+
+OLD = datetime.datetime.utcnow() - datetime.timedelta(days=1000)
+
+
+async def seed(db):
+    db.add(models.Region(id=1, country="US", name="Region", abbreviation="R"))
+    db.add(models.School(id=1, abbreviation="S", name="School", region_id=1))
+    db.add(models.User(id=1, email="a@b.io", first_name="A", last_name="B", school_id=1))
+    db.add(models.Event(id=1, name="Event", date=datetime.date.today()))
+    db.add(models.Role(id=1, name="Role"))
+    await db.commit()
+
+
+def log(date: datetime.datetime) -> schemas.VolunteerRecordCreate:
+    return schemas.VolunteerRecordCreate(date=date, hours=2, reflection="", event_id=1, role_id=1)
+
+
+async def ids(db, model) -> list[int]:
+    return (await db.execute(select(model.id).order_by(model.id))).scalars().all()
+
+
+def test_archived_ids_are_not_reused(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+            await crud.create_volunteer_record(db, log(datetime.datetime.utcnow()), 1)
+            backdated = await crud.create_volunteer_record(db, log(OLD), 1)  # the newest id, and the one archived
+            await crud.archive_volunteer_records(db)
+            again = await crud.create_volunteer_record(db, log(OLD), 1)
+            assert again.id > backdated.id
+            await crud.archive_volunteer_records(db)
+            assert await ids(db, models.VolunteerRecordArchive) == [backdated.id, again.id]
+            assert await ids(db, models.VolunteerRecord) == [1]
+
+    database.run(check)
+
+
+def test_migration_rebuilds_the_table_and_renumbers_reused_ids(database):
+    async def check(session_factory):
+        engine = session_factory.kw['bind']
+        async with session_factory() as db:
+            await seed(db)
+        async with engine.begin() as conn:
+            # volunteer_record as it was before migration 3, with id 2 archived and then handed out again
+            await conn.exec_driver_sql('DROP TABLE volunteer_record')
+            await conn.exec_driver_sql(
+                'CREATE TABLE volunteer_record (id INTEGER NOT NULL, date DATETIME, hours INTEGER, reflection VARCHAR, role_id INTEGER, '
+                'team_id INTEGER, event_id INTEGER, user_id INTEGER, PRIMARY KEY (id), UNIQUE (id))')
+            await conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_date ON volunteer_record (date)')
+            await conn.exec_driver_sql("INSERT INTO volunteer_record (id, date, hours, user_id) VALUES "
+                                       "(1, '2026-01-01 00:00:00', 1, 1), (2, '2026-01-02 00:00:00', 5, 1)")
+            await conn.exec_driver_sql("INSERT INTO volunteer_record_archive (id, date, hours, user_id) VALUES (2, '2020-01-01 00:00:00', 3, 1)")
+            await conn.exec_driver_sql('PRAGMA user_version = 2')
+        async with engine.begin() as conn:
+            await migrate(conn)
+        async with engine.connect() as conn:
+            table = (await conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'volunteer_record'")).scalar()
+            indexes = (await conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'volunteer_record' "
+                                                  "AND name LIKE 'ix_%' ORDER BY name")).scalars().all()
+            rows = (await conn.exec_driver_sql('SELECT id, hours FROM volunteer_record ORDER BY id')).all()
+        assert 'AUTOINCREMENT' in table
+        assert indexes == ['ix_volunteer_record_date', 'ix_volunteer_record_event_id', 'ix_volunteer_record_role_id',
+                           'ix_volunteer_record_team_id', 'ix_volunteer_record_user_id_date']
+        assert [tuple(row) for row in rows] == [(1, 1), (3, 5)]  # the record that took id 2 keeps its data under a new id
+        async with session_factory() as db:
+            db.add(models.VolunteerRecord(date=OLD, hours=1, user_id=1))
+            await db.commit()
+            assert await db.scalar(select(func.max(models.VolunteerRecord.id))) == 4
+
+    database.run(check)
+
+
+def days_ago(days: int) -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
+
+
+def test_paging_merges_backdated_records_with_archived_ones(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+            for days in [800, 900]:
+                await crud.create_volunteer_record(db, log(days_ago(days)), 1)
+            await crud.archive_volunteer_records(db)
+            for days in [1, 1000, 1100]:  # logged after the archive run, two of them backdated past it
+                await crud.create_volunteer_record(db, log(days_ago(days)), 1)
+            pages = []
+            cursor = None
+            while True:
+                page, cursor = await crud.get_volunteer_records_by_user(db, 1, 2, cursor)
+                pages.append([(datetime.datetime.utcnow() - record.date).days for record in page])
+                if cursor is None:
+                    return pages
+
+    assert database.run(check) == [[1, 800], [900, 1000], [1100]]
+
+
+def test_recent_pages_skip_the_archive(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+            await crud.create_volunteer_record(db, log(days_ago(800)), 1)
+            await crud.archive_volunteer_records(db)
+            for days in [1, 2, 3]:
+                await crud.create_volunteer_record(db, log(days_ago(days)), 1)
+            database.statements.clear()
+            page, cursor = await crud.get_volunteer_records_by_user(db, 1, 2)
+            assert cursor is not None and len(page) == 2
+            assert not [statement for statement in database.statements if 'volunteer_record_archive' in statement]
+
+    database.run(check)
@@ -0,0 +1,210 @@
+import asyncio
+import contextlib
+import time
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from processes import fetch, start_workers, wait_for
+from website.core.invalidation import CacheBus, RedisBackend, SQLiteBackend
+
+POLL_SECONDS = 0.05
+
+
+@pytest.fixture(scope='module')
+def resp_server():
+    pytest.importorskip('redis', minversion='4.2', reason="the Redis backend needs requirements-redis.txt installed")
+    from resp_server import RespServer
+    server = RespServer()
+    yield server
+    server.stop()
+
+
+class Backends:
+    # builds either backend over the same test database or stand-in server, and can take it away for a while
+    def __init__(
+            self,
+            kind: str,
+            resp_server,
+    ):
+        self.kind = kind
+        self.resp_server = resp_server
+        self.prefix = f"cache_bus:{time.monotonic_ns()}:"  # the server outlives a test, so each starts on fresh keys
+
+    def create(
+            self,
+            session_factory,
+            grace: float = 0.0,
+    ):
+        if self.kind == 'redis':
+            return RedisBackend(self.resp_server.url, 3600, self.prefix, grace)
+        return SQLiteBackend(session_factory, session_factory, 0)  # retention 0, so a prune drops all but the newest
+
+    async def expire(
+            self,
+            backend,
+    ):
+        if self.kind == 'redis':
+            self.resp_server.expire(f"{self.prefix}event:")
+        else:
+            await backend.prune()
+
+    @contextlib.asynccontextmanager
+    async def outage(
+            self,
+            backend,
+            tmp_path,
+    ):
+        if self.kind == 'redis':
+            await asyncio.to_thread(self.resp_server.pause)
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(self.resp_server.resume)
+            return
+        # a database file that can't be opened
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'test.db'}", future=True)
+        read_session_factory = backend.read_session_factory
+        backend.read_session_factory = sessionmaker(bind=engine, class_=AsyncSession)
+        try:
+            yield
+        finally:
+            backend.read_session_factory = read_session_factory
+            await engine.dispose()
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def backends(request) -> Backends:
+    return Backends(request.param, request.getfixturevalue('resp_server') if request.param == 'redis' else None)
+
+
+def make_bus(
+        poll_interval: float = 3600,
+        max_lag: float = 3600,
+) -> tuple[CacheBus, list]:
+    bus = CacheBus(poll_interval, max_lag)
+    keys = []
+    bus.subscribe('principal', keys.append)
+    return bus, keys
+
+
+def test_events_reach_other_workers(database, backends):
+    async def check(session_factory):
+        (writer, _), (reader, keys) = make_bus(), make_bus()
+        await writer.start(backends.create(session_factory))
+        await reader.start(backends.create(session_factory))
+        try:
+            await writer.publish('principal', '1')
+            await writer.publish('principal', '2')
+            await reader.poll()
+            await writer.poll()
+        finally:
+            await writer.stop()
+            await reader.stop()
+        return reader.stats(), writer.stats(), keys
+
+    reader, writer, keys = database.run(check)
+    assert keys == ['1', '2']
+    assert reader['received'] == 2 and reader['flushes'] == 0
+    assert writer['received'] == 0 and writer['epoch'] == 2  # its own events were applied when published
+
+
+def test_pruned_events_flush_once(database, backends):
+    async def check(session_factory):
+        (writer, _), (reader, keys) = make_bus(), make_bus()
+        await writer.start(backends.create(session_factory))
+        await reader.start(backends.create(session_factory))
+        try:
+            for id in range(5):
+                await writer.publish('principal', str(id))
+            await backends.expire(writer.backend)
+            await reader.poll()
+            flushed = reader.stats()
+            await writer.publish('principal', 'after')
+            await reader.poll()
+        finally:
+            await writer.stop()
+            await reader.stop()
+        return flushed, reader.stats(), keys
+
+    flushed, caught_up, keys = database.run(check)
+    assert flushed['flushes'] == 1 and flushed['epoch'] == 5
+    assert caught_up['flushes'] == 1 and caught_up['received'] == 1
+    assert keys == [None, 'after']
+
+
+def test_redis_waits_for_events_being_written(database, backends):
+    if backends.kind != 'redis':
+        pytest.skip("SQLite ids are only visible once their event is")
+
+    async def check(session_factory):
+        bus, keys = make_bus()
+        backend = backends.create(session_factory, grace=0.2)
+        await bus.start(backend)
+        try:
+            # a publisher between its INCR and its SET, then one that finished
+            await backend.redis.incr(f"{backends.prefix}epoch")
+            await backend.publish('principal', '2', 'elsewhere')
+            await bus.poll()
+            waiting = bus.stats()
+            await asyncio.sleep(0.1)
+            await bus.poll()
+            still_waiting = bus.stats()
+            await asyncio.sleep(0.2)
+            await bus.poll()
+        finally:
+            await bus.stop()
+        return waiting, still_waiting, bus.stats(), keys
+
+    waiting, still_waiting, given_up, keys = database.run(check)
+    assert waiting['epoch'] == 0 and waiting['flushes'] == 0
+    assert still_waiting['epoch'] == 0  # not missing for the whole grace period yet
+    assert given_up['flushes'] == 1 and given_up['epoch'] == 2
+    assert keys == [None]
+
+
+def test_lagging_worker_flushes_until_it_catches_up(database, backends, tmp_path):
+    async def check(session_factory):
+        bus, keys = make_bus(poll_interval=0.01, max_lag=0.05)
+        backend = backends.create(session_factory)
+        await bus.start(backend)
+        try:
+            async with backends.outage(backend, tmp_path):
+                await asyncio.sleep(0.4)
+            lagging = bus.stats()
+            await asyncio.sleep(0.1)
+            recovered = bus.stats()
+            await asyncio.sleep(0.2)
+        finally:
+            await bus.stop()
+        return lagging, recovered, bus.stats()
+
+    lagging, recovered, later = database.run(check)
+    assert lagging['errors'] > 0
+    assert lagging['flushes'] > 1  # every failed poll past the bound, not just the first
+    assert later['flushes'] == recovered['flushes']
+
+
+@pytest.mark.parametrize('kind', ['sqlite', 'redis'])
+def test_workers_see_each_others_writes(request, tmp_path, kind):
+    settings = {'CACHE_BUS_BACKEND': kind, 'CACHE_BUS_POLL_SECONDS': POLL_SECONDS}
+    if kind == 'redis':
+        settings['CACHE_BUS_REDIS_URL'] = request.getfixturevalue('resp_server').url
+    with start_workers(tmp_path, 2, settings) as (a, b):
+        def login() -> dict:
+            status, body = fetch(f"{a}/api/auth/login-user", {'username': "a@b.io", 'password': "password1"}, form=True)
+            assert status == 200
+            return {'Authorization': f"Bearer {body['access_token']}"}
+
+        assert fetch(f"{a}/api/auth/signup-user", {'email': "a@b.io", 'first_name': "A", 'last_name': "B", 'password': "password1"},
+                       form=True)[0] == 200
+        headers = login()
+        assert fetch(f"{b}/api/user/get-teams-of-user", headers=headers)[0] == 200  # b now has the principal cached
+        assert fetch(f"{a}/api/auth/logout-user", {}, headers, form=True)[0] == 200
+        assert wait_for(lambda: fetch(f"{b}/api/user/get-teams-of-user", headers=headers)[0] == 401)
+
+        headers = login()
+        version = fetch(f"{b}/api/admin/metrics", headers=headers)[1]['reference_data']['version']
+        assert fetch(f"{a}/api/admin/create-region", {'country': "US", 'name': "Another region", 'abbreviation': "AR"}, headers)[0] == 200
+        assert wait_for(lambda: fetch(f"{b}/api/admin/metrics", headers=headers)[1]['reference_data']['version'] > version)
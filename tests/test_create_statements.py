@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from website.core import crud, models, schemas
+
+NOW = datetime.datetime.utcnow()
+
+
+async def seed(db):
+    db.add(models.Region(id=1, country="US", name="Region", abbreviation="R"))
+    db.add(models.School(id=1, abbreviation="S", name="School", region_id=1))
+    db.add(models.Program(id=1, name="Program", region_id=1))
+    db.add(models.Team(id=1, name="Team", program_id=1))
+    db.add(models.User(id=1, email="a@b.io", first_name="A", last_name="B", school_id=1))
+    db.add(models.Event(id=1, name="Event", date=datetime.date.today()))
+    db.add(models.Role(id=1, name="Role"))
+    db.add(models.Permission(name="volunteer", bit=0))
+    db.add(models.Permission(name="coach", bit=1))
+    await db.commit()
+
+
+PLAIN = [
+    (crud.create_user, schemas.UserCreate(email="c@d.io", first_name="C", last_name="D", password="hash")),
+    (crud.create_refresh_token, schemas.RefreshTokenCreate(user_id=1, token_hash="hash", created=NOW, expires=NOW)),
+    (crud.create_region, schemas.RegionCreate(country="US", name="Another region", abbreviation="AR")),
+    (crud.create_program, schemas.ProgramCreate(name="Another program", region_id=1)),
+    (crud.create_school, schemas.SchoolCreate(abbreviation="AS", name="Another school", region_id=1)),
+    (crud.create_event, schemas.EventCreate(name="Another event", date=datetime.date.today())),
+    (crud.create_team, schemas.TeamCreate(name="Another team", program_id=1)),
+    (crud.create_role, schemas.RoleCreate(name="Another role")),
+    (crud.create_trait, schemas.TraitCreate(name="Trait")),
+    (crud.create_payment, schemas.PaymentCreate(date=NOW, amount=1, purpose="dues", user_id=1)),
+    (crud.create_school_event_link, schemas.SchoolEventAssociation(supervisor="S", supervisor_contact="s@b.io", school_id=1, event_id=1)),
+    (crud.create_event_role_link, schemas.EventRoleAssociation(event_id=1, role_id=1)),
+    (crud.create_team_role_link, schemas.TeamRoleAssociation(team_id=1, role_id=1)),
+    (crud.create_team_membership, schemas.TeamMembership(user_id=1, team_id=1, role_id=1)),
+]
+
+# these take the author as a separate argument
+PLAIN_BY_USER = [
+    (crud.create_feedback, schemas.FeedbackCreate(date=NOW, content="Thanks", to_user_id=1)),
+    (crud.create_training_record, schemas.TrainingRecordCreate(date=NOW, level="1", completed=True, coach_id=1)),
+    (crud.create_request, schemas.RequestCreate(date=NOW, purpose="leave", content="Please")),
+]
+
+
+def run_create(database, create, *args):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+        async with session_factory() as db:
+            database.statements.clear()
+            return await create(db, *args)
+
+    assert database.run(check) is not None
+    return database.statements
+
+
+@pytest.mark.parametrize('create, info', PLAIN, ids=lambda value: getattr(value, '__name__', ''))
+def test_create_is_one_insert(database, create, info):
+    statements = run_create(database, create, info)
+    assert len(statements) == 1 and database.count('INSERT') == 1
+
+
+@pytest.mark.parametrize('create, info', PLAIN_BY_USER, ids=lambda value: getattr(value, '__name__', ''))
+def test_create_by_user_is_one_insert(database, create, info):
+    statements = run_create(database, create, info, 1)
+    assert len(statements) == 1 and database.count('INSERT') == 1
+
+
+@pytest.mark.parametrize('create, args, statements', [
+    (crud.create_permission, [schemas.Permission(name="admin")], 2),  # the next free bit, then the insert
+    (crud.create_revoked_token, [schemas.RevokedToken(jti="jti", expires=NOW)], 2),  # merge looks the jti up first
+    (crud.create_user_permission_link, [schemas.UserPermissions(user_id=1, permission_name="coach")], 1),
+    (crud.create_user_permission_link, [schemas.UserPermissions(user_id=1, permission_name="volunteer")], 3),  # scopes, then the counter upsert
+    (crud.create_volunteer_record, [schemas.VolunteerRecordCreate(date=NOW, hours=2, reflection="", event_id=1, role_id=1), 1], 5),  # summary, scopes, counters and rollup
+], ids=['create_permission', 'create_revoked_token', 'create_user_permission_link',
+        'create_user_permission_link-volunteer', 'create_volunteer_record'])
+def test_create_exceptions(database, create, args, statements):
+    assert len(run_create(database, create, *args)) == statements
@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+
+from website.core import crud, models
+
+
+async def seed(db):
+    db.add(models.Region(id=1, country="US", name="Region", abbreviation="R"))
+    db.add(models.School(id=1, abbreviation="S", name="School", region_id=1))
+    db.add(models.User(id=1, email="a@b.io", first_name="A", last_name="B", school_id=1))
+    db.add(models.Event(id=1, name="Event", date=datetime.date.today()))
+    db.add(models.Role(id=1, name="Role"))
+    db.add(models.VolunteerRecord(date=datetime.datetime.utcnow(), hours=1, event_id=1, role_id=1, user_id=1))
+    await db.commit()
+
+
+@pytest.mark.parametrize('profile, statements', [
+    (None, 1),
+    ('auth', 2),  # user, then permissions
+    ('profile', 1),  # school and region are joined in
+    ('full', 10),  # the join plus one selectin per collection
+])
+def test_statements_per_profile(database, profile, statements):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+        async with session_factory() as db:
+            database.statements.clear()
+            user = await crud.get_user(db, id=1, profile=profile)
+        return user
+
+    user = database.run(check)
+    assert user.id == 1
+    assert len(database.statements) == statements
+
+
+def test_unloaded_relationships_raise(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+        async with session_factory() as db:
+            return await crud.get_user(db, id=1, profile='auth')
+
+    user = database.run(check)
+    assert [permission.permission_name for permission in user.permissions] == []
+    with pytest.raises(Exception):
+        user.school
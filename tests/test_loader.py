@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+import urllib.request
+
+from processes import fetch, start_workers
+from website.core import models
+from website.core.loader import RequestLoader
+
+
+async def seed(db):
+    db.add(models.Region(id=1, country="US", name="Region", abbreviation="R"))
+    db.add(models.School(id=1, abbreviation="S", name="School", region_id=1))
+    for id in range(1, 4):
+        db.add(models.User(id=id, email=f"{id}@b.io", first_name="A", last_name="B", school_id=1))
+    await db.commit()
+
+
+def test_concurrent_lookups_are_one_query(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+        async with session_factory() as db:
+            loader = RequestLoader(db)
+            database.statements.clear()
+            users = await asyncio.gather(loader.get_user(1), loader.get_user(2), loader.get_user(1), loader.get_user(99))
+            batched = list(database.statements)
+            assert await loader.get_user(2) is users[1]  # already loaded for this request
+            assert await loader.get_user(None) is None
+        return [user.id if user is not None else None for user in users], batched
+
+    ids, batched = database.run(check)
+    assert ids == [1, 2, 1, None]
+    assert len(batched) == 1 and ' IN ' in batched[0]
+    assert len(database.statements) == 1
+
+
+def test_profiles_are_loaded_separately(database):
+    async def check(session_factory):
+        async with session_factory() as db:
+            await seed(db)
+        async with session_factory() as db:
+            loader = RequestLoader(db)
+            database.statements.clear()
+            plain, profile = await asyncio.gather(loader.get_user(1), loader.get_user(1, profile='profile'))
+            return plain, profile
+
+    plain, profile = database.run(check)
+    assert len(database.statements) == 2
+    assert plain.id == profile.id == 1
+    assert profile.school.region.name == "Region"
+
+
+def test_query_count_header(tmp_path):
+    with start_workers(tmp_path, 1, {'DEBUG': True}) as (url,):
+        assert fetch(f"{url}/api/auth/signup-user", {'email': "a@b.io", 'first_name': "A", 'last_name': "B", 'password': "password1"},
+                     form=True)[0] == 200
+        with sqlite3.connect(tmp_path / 'database.db') as conn:
+            conn.execute("INSERT INTO region (id, country, name, abbreviation) VALUES (1, 'US', 'Region', 'R')")
+            conn.execute("INSERT INTO school (id, abbreviation, name, region_id) VALUES (1, 'S', 'School', 1)")
+            conn.execute("UPDATE user SET school_id = 1 WHERE id = 1")
+        status, body = fetch(f"{url}/api/auth/login-user", {'username': "a@b.io", 'password': "password1"}, form=True)
+        assert status == 200
+        request = urllib.request.Request(f"{url}/api/user/current-user", headers={'Authorization': f"Bearer {body['access_token']}"})
+        counts = []
+        for _ in range(2):
+            with urllib.request.urlopen(request) as response:
+                counts.append(response.headers['X-Query-Count'])
+    assert counts == ['2', '1']  # the token's user, then the profile; once the principal is cached only the profile
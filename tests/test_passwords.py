@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+from website.core.passwords import PasswordHasher
+
+
+def test_failed_jobs_are_not_counted_as_completed():
+    hasher = PasswordHasher(1, 1)
+
+    async def check():
+        hashed = await hasher.hash("password1")
+        assert await hasher.verify("password1", hashed)
+        with pytest.raises(ValueError):
+            await hasher.verify("password1", "not a bcrypt hash")
+
+    try:
+        asyncio.run(check())
+    finally:
+        hasher.shutdown()
+    stats = hasher.stats()
+    assert stats["completed"] == 2
+    assert stats["failed"] == 1
+    assert stats["in_flight"] == 0
+    assert hasher.total_seconds > 0
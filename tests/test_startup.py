@@ -0,0 +1,14 @@
+import sqlite3
+
+from processes import start_workers
+from website.core.database import ADMIN_PERMISSIONS
+from website.core.migrations import MIGRATIONS
+
+
+def test_workers_starting_together_initialize_once(tmp_path):
+    with start_workers(tmp_path, 4, {}) as urls:
+        assert len(urls) == 4
+    with sqlite3.connect(tmp_path / 'database.db') as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == MIGRATIONS[-1][0]
+        permissions = conn.execute('SELECT name, bit FROM permission ORDER BY bit').fetchall()
+    assert permissions == [(name, bit) for bit, name in enumerate(ADMIN_PERMISSIONS)]
@@ -0,0 +1,60 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from website.api import auth
+from website.core.throttle import LoginThrottle, TokenBucketLimiter
+
+
+def make_throttle(email_burst: int = 5, ip_burst: int = 200) -> LoginThrottle:
+    return LoginThrottle(TokenBucketLimiter(email_burst, 60, 1000), TokenBucketLimiter(ip_burst, 60, 1000))
+
+
+def test_successful_logins_are_not_charged():
+    throttle = make_throttle(ip_burst=3)
+    for i in range(100):
+        assert throttle.take(f"{i}@b.io", "10.0.0.1") == 0
+        throttle.succeeded(f"{i}@b.io", "10.0.0.1")
+    assert throttle.ip_limiter.rejected == 0
+
+
+def test_failed_attempts_are_charged():
+    throttle = make_throttle(email_burst=5)
+    assert all(throttle.take("A@b.io", "10.0.0.1") == 0 for _ in range(5))
+    assert throttle.take("a@b.io", "10.0.0.2") > 0  # emails are compared case-insensitively
+
+
+def test_email_rejection_is_not_held_against_the_address():
+    throttle = make_throttle(email_burst=1, ip_burst=2)
+    assert throttle.take("a@b.io", "10.0.0.1") == 0
+    for _ in range(10):
+        assert throttle.take("a@b.io", "10.0.0.1") > 0
+    assert throttle.take("c@b.io", "10.0.0.1") == 0
+
+
+def request_from(client: str, headers: dict) -> Request:
+    return Request({'type': 'http', 'client': (client, 1234), 'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+def test_client_ip(monkeypatch):
+    request = request_from("10.0.0.9", {"X-Forwarded-For": "6.6.6.6, 1.2.3.4"})
+    assert auth.get_client_ip(request) == "10.0.0.9"
+    monkeypatch.setattr(auth, 'CLIENT_IP_HEADER', "X-Forwarded-For")
+    assert auth.get_client_ip(request) == "1.2.3.4"  # the spoofable entry the client sent is skipped
+    monkeypatch.setattr(auth, 'TRUSTED_PROXY_COUNT', 2)
+    assert auth.get_client_ip(request) == "6.6.6.6"
+    assert auth.get_client_ip(request_from("10.0.0.9", {})) == "10.0.0.9"
+
+
+def test_rejections_are_counted_without_the_database(monkeypatch):
+    throttle = make_throttle(email_burst=1, ip_burst=3)
+    monkeypatch.setattr(auth, 'login_throttle', throttle)
+    auth.check_login_throttle("a@b.io", "10.0.0.1")
+    with pytest.raises(HTTPException) as rejected:
+        auth.check_login_throttle("a@b.io", "10.0.0.1")  # the email's bucket
+    assert rejected.value.status_code == 429
+    for i in range(2):  # the first attempt still holds one of the address's tokens
+        auth.check_login_throttle(f"{i}@b.io", "10.0.0.1")
+    with pytest.raises(HTTPException):
+        auth.check_login_throttle("2@b.io", "10.0.0.1")  # the address's bucket
+    assert throttle.stats()['hashes_saved'] == 2
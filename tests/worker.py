@@ -0,0 +1,17 @@
+import ast
+import sys
+
+from website.core import config
+
+# python worker.py <port> [NAME=value ...], run from the directory the database should go in; each value is a
+# Python literal set on website.core.config before the app is imported
+for setting in sys.argv[2:]:
+    name, value = setting.split('=', 1)
+    setattr(config, name, ast.literal_eval(value))
+
+if __name__ == '__main__':
+    import uvicorn
+
+    from website.main import app
+
+    uvicorn.run(app, port=int(sys.argv[1]), log_level='warning')
@@ -4,8 +4,15 @@ from fastapi import APIRouter, Security, Depends, status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
+from website.core import crud, models, schemas
+from website.core.cache import principal_cache
 from website.core.database import get_session
+from website.core.invalidation import cache_bus
+from website.core.passwords import password_hasher
+from website.core.refdata import reference_data
+from website.core.revocation import deny_list
+from website.core.throttle import login_throttle_stats
+from website.core.writer import write_queue
 
 admin = APIRouter()
 
@@ -15,8 +22,7 @@ async def check_create_region(
         info: schemas.RegionCreate
 ):
     errors = {}
-    temp_region = await crud.get_region(db, name=info.name)
-    if temp_region is not None:
+    if info.name in (await reference_data.get(db)).regions_by_name or await crud.get_region(db, name=info.name) is not None:
         errors['all'] = "There is already a region with this name"
     if len(info.name) < 8:
         errors['name'] = "Region name must be at least 8 characters"
@@ -35,7 +41,7 @@ async def check_create_region(
 @admin.post('/api/admin/create-region')
 async def create_region(
         info: schemas.RegionCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_region(db, info)
@@ -48,9 +54,9 @@ async def check_create_program(
     errors = {}
     if len(info.name) < 3:
         errors['name'] = "Name must be at least 3 characters"
-    region = await crud.get_region(db, id=info.region_id)
-    if region is None:
-        errors['region_id'] = "This region does not exist"
+    errors.update(await crud.check_references(db, {
+        'region_id': (models.Region.id, info.region_id, "This region does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -64,7 +70,7 @@ async def check_create_program(
 @admin.post('/api/admin/create-program')
 async def create_program(
         info: schemas.ProgramCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_program(db, info)
@@ -75,11 +81,12 @@ async def check_create_school(
         info: schemas.SchoolCreate,
 ):
     errors = {}
-    region = await crud.get_region(db, id=info.region_id)
-    if region is None:
-        errors['region_id'] = "This region does not exist"
-    school = await crud.get_school(db, abbreviation=info.abbreviation, name=info.name)
-    if school is not None:
+    errors.update(await crud.check_references(db, {
+        'region_id': (models.Region.id, info.region_id, "This region does not exist"),
+    }))
+    snapshot = await reference_data.get(db)
+    if info.abbreviation in snapshot.schools_by_abbreviation or info.name in snapshot.schools_by_name or \
+            await crud.get_school(db, abbreviation=info.abbreviation) is not None or await crud.get_school(db, name=info.name) is not None:
         errors['all'] = "School with this name or abbreviation already exists"
     if len(info.abbreviation) > 5:
         errors['abbreviation'] = "Abbreviation must be at most 5 characters"
@@ -98,7 +105,7 @@ async def check_create_school(
 @admin.post('/api/admin/create-school')
 async def create_school(
         info: schemas.SchoolCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_school(db, info)
@@ -124,7 +131,7 @@ async def check_create_trait(
 @admin.post('/api/admin/create-trait')
 async def create_info(
         info: schemas.TraitCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session),
 ):
     return await check_create_trait(db, info)
@@ -136,9 +143,9 @@ async def check_log_payment(
 ):
     errors = {}
     # TODO: date regex
-    user = await crud.get_user(db, id=info.user_id)
-    if user is None:
-        errors['user_id'] = "This user does not exist"
+    errors.update(await crud.check_references(db, {
+        'user_id': (models.User.id, info.user_id, "This user does not exist"),
+    }))
     if info.amount > 10000:
         errors['amount'] = "Please double check the amount"
     if len(info.purpose) < 10:
@@ -156,7 +163,7 @@ async def check_log_payment(
 @admin.post('/api/admin/log-payment')
 async def log_payment(
         info: schemas.PaymentCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session),
 ):
     return await check_log_payment(db, info)
@@ -182,7 +189,7 @@ async def check_create_permission(
 @admin.post('/api/admin/create-permission')
 async def create_permission(
         info: schemas.Permission,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session),
 ):
     return await check_create_permission(db, info)
@@ -193,12 +200,10 @@ async def check_user_permission_link(
         info: schemas.UserPermissions
 ):
     errors = {}
-    permission = await crud.get_permission(db, name=info.permission_name)
-    if permission is None:
-        errors['permission_name'] = "This permission does not exist"
-    user = await crud.get_user(db, id=info.user_id)
-    if user is None:
-        errors['user_id'] = "This user does not exist"
+    errors.update(await crud.check_references(db, {
+        'permission_name': (models.Permission.name, info.permission_name, "This permission does not exist"),
+        'user_id': (models.User.id, info.user_id, "This user does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -212,7 +217,22 @@ async def check_user_permission_link(
 @admin.post('/api/admin/add-permission-to-user')
 async def add_permission_to_user(
         info: schemas.UserPermissions,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session),
 ):
     return await check_user_permission_link(db, info)
+
+
+@admin.get('/api/admin/metrics')
+async def get_metrics(
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
+):
+    return {
+        "principal_cache": principal_cache.stats(),
+        "reference_data": reference_data.stats(),
+        "cache_bus": cache_bus.stats(),
+        "password_hasher": password_hasher.stats(),
+        "login_throttle": login_throttle_stats(),
+        "deny_list": deny_list.stats(),
+        "write_queue": write_queue.stats(),
+    }
@@ -1,9 +1,13 @@
+import datetime
+import hashlib
 import json
+import math
+import secrets
 
 import jwt
 import time
 import uuid
-from typing import Optional, Dict
+from typing import Awaitable, Optional, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, status, Security, Request, Response, Form
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
@@ -11,12 +15,18 @@ from fastapi.responses import HTMLResponse
 from fastapi.security import SecurityScopes, OAuth2, OAuth2PasswordRequestForm
 from fastapi.security.utils import get_authorization_scheme_param
 from fastapi.templating import Jinja2Templates
-from passlib.hash import bcrypt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from website.core import crud, schemas
-from website.core.config import JWT_SECRET, JWT_ALG, JWT_EXPIRE_SECONDS
-from website.core.database import get_session
+from website.core import crud, models, schemas
+from website.core.cache import principal_cache
+from website.core.config import CLIENT_IP_HEADER, JWT_SECRET, JWT_ALG, JWT_EXPIRE_SECONDS, PASSWORD_HASH_RETRY_AFTER_SECONDS, REFRESH_TOKEN_EXPIRE_SECONDS, \
+    TRUSTED_PROXY_COUNT
+from website.core.database import get_read_session, get_session, grant_admin
+from website.core.loader import RequestLoader, get_loader
+from website.core.passwords import password_hasher, HashQueueFull
+from website.core.revocation import deny_list
+from website.core.scopes import scope_registry
+from website.core.throttle import login_throttle
 
 auth = APIRouter()
 
@@ -47,36 +57,55 @@ oauth2_scheme = OAuth2PasswordBearerCustom(
 )
 
 
-async def get_user_from_token(
-        db: AsyncSession = Depends(get_session),
+async def get_principal(
+        db: AsyncSession = Depends(get_read_session),
         token: str = Depends(oauth2_scheme)
-) -> Optional[schemas.User]:
+) -> Optional[schemas.Principal]:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        email = payload.get('sub')
-        user = await crud.get_user(db, email=email)
-        return user
+        if deny_list.is_revoked(payload.get('jti')):
+            return None
+        key = payload.get('jti') or payload.get('sub')
+        principal = principal_cache.get(key)
+        if principal is None:
+            user = await crud.get_user(db, email=payload.get('sub'))
+            if user is None:
+                return None
+            if 'scp' in payload:
+                scope_mask = payload['scp']
+            else:
+                scope_mask = scope_registry.grant_mask(payload.get('scopes', []))
+            principal = schemas.Principal(id=user.id, email=user.email, scope_mask=scope_mask, school_id=user.school_id,
+                                          jti=payload.get('jti'), exp=payload.get('exp'))
+            principal_cache.set(key, principal, owner=user.id, expires_at=payload.get('exp'))
+        return principal
     except:
         # database errors, jwt errors, no token errors
         return None
 
 
+async def get_user_from_token(
+        loader: RequestLoader = Depends(get_loader),
+        principal: Optional[schemas.Principal] = Depends(get_principal)
+) -> Optional[models.User]:
+    if principal is None:
+        return None
+    return await loader.get_user(principal.id)
+
+
 async def get_scopes_from_token(
-        token: str = Depends(oauth2_scheme)
-) -> Optional[list[str]]:
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        token_scopes = payload.get('scopes', [])
-        return token_scopes
-    except:
+        principal: Optional[schemas.Principal] = Depends(get_principal)
+) -> Optional[int]:
+    if principal is None:
         return None
+    return principal.scope_mask
 
 
 async def get_current_user_required(
         security_scopes: SecurityScopes,
-        user: Optional[schemas.User] = Depends(get_user_from_token),
-        scopes: Optional[list[str]] = Depends(get_scopes_from_token)
-) -> schemas.User:
+        user: Optional[schemas.Principal] = Depends(get_principal),
+        scopes: Optional[int] = Depends(get_scopes_from_token)
+) -> schemas.Principal:
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -87,29 +116,42 @@ async def get_current_user_required(
         authenticate_value = f'Bearer scope="{security_scopes.scope_str}"'
     else:
         authenticate_value = f'Bearer'
-    for scope in security_scopes.scopes:
-        if scope not in scopes:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="You do not have permission to access this page",
-                headers={"WWW-Authenticate": authenticate_value},
-            )
+    required = scope_registry.required_mask(security_scopes.scopes)
+    if required is None or scopes & required != required:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You do not have permission to access this page",
+            headers={"WWW-Authenticate": authenticate_value},
+        )
     return user
 
 
 async def get_current_user_optional(
-        user: Optional[schemas.User] = Depends(get_user_from_token)
-) -> Optional[schemas.User]:
+        user: Optional[schemas.Principal] = Depends(get_principal)
+) -> Optional[schemas.Principal]:
     return user
 
 
+async def run_password_hasher(
+        job: Awaitable
+):
+    try:
+        return await job
+    except HashQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+        )
+
+
 async def check_change_password(
         db: AsyncSession,
         user: schemas.UserUpdatePassword
 ):
     errors = {}
     temp_user = await crud.get_user(db, email=user.email)
-    if not bcrypt.verify(user.old_password, temp_user.password):
+    if not await run_password_hasher(password_hasher.verify(user.old_password, temp_user.password)):
         errors['old_password'] = "Incorrect password"
     if user.old_password == user.new_password:
         errors['all'] = "New password cannot be the same as old password"
@@ -121,8 +163,9 @@ async def check_change_password(
             detail=f"{json.dumps(errors)}"
         )
 
-    user.new_password = bcrypt.hash(user.new_password)
+    user.new_password = await run_password_hasher(password_hasher.hash(user.new_password))
     await crud.update_user_password(db, user)
+    await crud.revoke_refresh_tokens_by_user(db, temp_user.id)
     return {"status": "success", "detail": "Changed password!"}
 
 
@@ -130,14 +173,39 @@ async def check_change_password(
 async def change_password(
         old_password: str = Form(),
         new_password: str = Form(),
-        current_user: schemas.User = Security(get_current_user_required, scopes=['me']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['me']),
         db: AsyncSession = Depends(get_session)
 ):
-    updated_user = schemas.UserUpdatePassword(email=current_user.email, first_name=current_user.first_name, last_name=current_user.last_name,
+    user = await crud.get_user(db, id=current_user.id)
+    updated_user = schemas.UserUpdatePassword(email=user.email, first_name=user.first_name, last_name=user.last_name,
                                               old_password=old_password, new_password=new_password)
     return await check_change_password(db, updated_user)
 
 
+def get_client_ip(
+        request: Request
+) -> str:
+    if CLIENT_IP_HEADER is not None and CLIENT_IP_HEADER in request.headers:
+        # entries before the ones our proxies appended are whatever the client sent, so they aren't trusted
+        forwarded = [address.strip() for address in request.headers[CLIENT_IP_HEADER].split(',')]
+        return forwarded[max(len(forwarded) - TRUSTED_PROXY_COUNT, 0)]
+    return request.client.host if request.client else ""
+
+
+def check_login_throttle(
+        email: str,
+        client_ip: str
+):
+    # before any database work, so a flood of attempts costs no queries
+    retry_after = login_throttle.take(email, client_ip)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{json.dumps({'all': 'Too many login attempts, please try again later'})}",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
 async def check_login_user(
         db: AsyncSession,
         email: str,
@@ -151,7 +219,7 @@ async def check_login_user(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=f"{json.dumps(errors)}"
         )
-    if not bcrypt.verify(password, user.password):
+    if not await run_password_hasher(password_hasher.verify(password, user.password)):
         errors['password'] = "Incorrect password"
     if errors:
         raise HTTPException(
@@ -164,6 +232,7 @@ async def check_login_user(
 
 @auth.post('/api/auth/login-user')
 async def login_user(
+        request: Request,
         response: Response,
         # email: str = Form(),
         # password: str = Form(), for cookies
@@ -172,23 +241,85 @@ async def login_user(
 ):
     email = form_data.username
     password = form_data.password
+    client_ip = get_client_ip(request)
+    check_login_throttle(email, client_ip)
     await check_login_user(db, email, password)
-    user = await crud.get_user(db, email=email)
-    scopes = []
-    for scope in user.permissions:
-        scopes.append(scope.permission_name)
+    login_throttle.succeeded(email, client_ip)
+    user = await crud.get_user(db, email=email, profile='auth')
+    access_token = create_access_token(user)
+    refresh_token = await issue_refresh_token(db, user.id)
+    # response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True, samesite="Strict")
+    return {'access_token': access_token, 'token_type': 'bearer', 'refresh_token': refresh_token}
 
+
+def create_access_token(
+        user: models.User
+) -> str:
     token_info = schemas.Token(
         iss="dmecc",
-        sub=email,
+        sub=user.email,
         iat=int(time.time()),
         exp=int(time.time() + JWT_EXPIRE_SECONDS),
         jti=str(uuid.uuid4()),
-        scopes=scopes
+        scp=scope_registry.grant_mask(scope.permission_name for scope in user.permissions)
     )
-    access_token = jwt.encode(token_info.dict(), JWT_SECRET)
-    # response.set_cookie(key="access_token", value=f"Bearer {access_token}", httponly=True, samesite="Strict")
-    return {'access_token': access_token, 'token_type': 'bearer'}
+    return jwt.encode(token_info.dict(exclude={'scopes'}), JWT_SECRET)
+
+
+def hash_refresh_token(
+        token: str
+) -> str:
+    # refresh tokens are 256 random bits, so a fast digest is enough and keeps lookups on the unique index
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue_refresh_token(
+        db: AsyncSession,
+        user_id: int,
+        replaces: Optional[models.RefreshToken] = None
+) -> Optional[str]:
+    token = secrets.token_urlsafe(32)
+    now = datetime.datetime.utcnow()
+    info = schemas.RefreshTokenCreate(user_id=user_id, token_hash=hash_refresh_token(token), created=now,
+                                      expires=now + datetime.timedelta(seconds=REFRESH_TOKEN_EXPIRE_SECONDS))
+    if await crud.create_refresh_token(db, info, replaces) is None:
+        return None
+    return token
+
+
+async def check_refresh_token(
+        db: AsyncSession,
+        token: str
+) -> models.RefreshToken:
+    stored = await crud.get_refresh_token(db, hash_refresh_token(token))
+    if stored is not None and stored.revoked:
+        # a rotated token came back, so assume it leaked and end every session of this user
+        await crud.revoke_refresh_tokens_by_user(db, stored.user_id)
+    if stored is None or stored.revoked or stored.expires < datetime.datetime.utcnow():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Your session has expired, please log in again",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return stored
+
+
+@auth.post('/api/auth/refresh-token')
+async def refresh_access_token(
+        refresh_token: str = Form(),
+        db: AsyncSession = Depends(get_session)
+):
+    stored = await check_refresh_token(db, refresh_token)
+    user = await crud.get_user(db, id=stored.user_id, profile='auth')
+    new_refresh_token = await issue_refresh_token(db, user.id, replaces=stored)
+    if new_refresh_token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Your session has expired, please log in again",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = create_access_token(user)
+    return {'access_token': access_token, 'token_type': 'bearer', 'refresh_token': new_refresh_token}
 
 
 async def check_signup_user(
@@ -213,8 +344,10 @@ async def check_signup_user(
             detail=f"{json.dumps(errors)}"
         )
 
-    user.password = bcrypt.hash(user.password)
-    await crud.create_user(db, user)
+    user.password = await run_password_hasher(password_hasher.hash(user.password))
+    new_user = await crud.create_user(db, user)
+    if new_user.id == 1:
+        await grant_admin(db, new_user.id)  # the first account is the administrator
     return {"status": "success", "detail": "Signed up!"}
 
 
@@ -233,7 +366,13 @@ async def signup_user(
 @auth.post('/api/auth/logout-user')
 async def logout_user(
         response: Response,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer'])
+        refresh_token: Optional[str] = Form(None),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_session)
 ):
+    if current_user.jti is not None and current_user.exp is not None:
+        await crud.create_revoked_token(db, schemas.RevokedToken(jti=current_user.jti, expires=datetime.datetime.utcfromtimestamp(current_user.exp)))
+    if refresh_token is not None:
+        await crud.revoke_refresh_token(db, hash_refresh_token(refresh_token))
     response.delete_cookie("access_token")
     return {"status": "success", "detail": "Logged out!"}
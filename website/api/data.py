@@ -1,25 +1,40 @@
 import datetime
 import json
+from typing import Optional
 
-from fastapi import APIRouter, Security, Depends, status, HTTPException
+from fastapi import APIRouter, Security, Depends, status, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
-from website.core.database import get_session
+from website.core import crud, models, schemas
+from website.core.config import HOURS_SERIES_MAX_BUCKETS, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from website.core.database import get_read_session
 
 data = APIRouter()
 
 
+def set_next_cursor(
+        response: Response,
+        next_cursor: Optional[str]
+):
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+
 @data.get('/api/data/get-recent-events')
 async def get_recent_events(
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
 ):
     events = {}
     events['0'] = "Select an event"
-    for event in await crud.get_recent_events_by_school(db, current_user.school.id):
+    page, next_cursor = await crud.get_recent_events_by_school(db, current_user.school_id, limit, cursor)
+    for event in page:
         events[event.id] = event.name
+    set_next_cursor(response, next_cursor)
     if len(events) == 1:
         events['0'] = "No available events"
     return json.dumps(events)
@@ -28,13 +43,17 @@ async def get_recent_events(
 @data.get('/api/data/get-roles-of-event')  # TODO: only show roles user has
 async def get_event_roles(
         event_id: int,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
 ):
     roles = {}
     roles['0'] = "Select a position"
-    for role in await crud.get_roles_by_event(db, event_id):
-        roles[role.id] = role.name
+    page, next_cursor = await crud.get_role_ids_by_event(db, event_id, limit, cursor)
+    roles.update(await crud.get_role_names(db, page))
+    set_next_cursor(response, next_cursor)
     if len(roles) == 1:
         roles['0'] = "No available positions"
     return json.dumps(roles)
@@ -43,49 +62,171 @@ async def get_event_roles(
 @data.get('/api/data/get-roles-of-team')  # TODO: only show roles user has
 async def get_team_roles(
         team_id: int,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
 ):
     roles = {}
     roles['0'] = "Select a position"
-    for role in await crud.get_roles_by_team(db, team_id):
-        roles[role.id] = role.name
+    page, next_cursor = await crud.get_role_ids_by_team(db, team_id, limit, cursor)
+    roles.update(await crud.get_role_names(db, page))
+    set_next_cursor(response, next_cursor)
     if len(roles) == 1:
         roles['0'] = "No available positions"
     return json.dumps(roles)
 
 
-@data.get('/api/data/get-top-volunteers')  # TODO: create snapshot and rank all volunteers
+@data.get('/api/data/get-top-volunteers')
 async def get_top_volunteer(
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(10, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        db: AsyncSession = Depends(get_read_session)
 ):
     volunteers = {}
-    count = 0
-    for volunteer in await crud.get_top_volunteers(db, 10, 0):
-        count = count + 1
-        total_hours = await crud.get_user_total_hours(db, volunteer.id)
-        if volunteer.start_date is None:
-            yrs = 0
-        else:
-            yrs = (datetime.datetime.now().date() - volunteer.start_date).days
-        if volunteer.school is None:
-            school = "_"
-            org = "_"
-            loc = "_"
-        else:
-            school = volunteer.school.abbreviation
-            org = volunteer.school.region.abbreviation
-            loc = volunteer.school.region.country
-        if volunteer.training_level is None:
-            lvl = "_"
-        else:
-            lvl = volunteer.training_level
-        if volunteer.rank is None:
-            rnk = "_"
-        else:
-            rnk = volunteer.rank
-
-        volunteers[count] = json.dumps(
-            {"name": f"{volunteer.first_name} {volunteer.last_name}", "school": school, "org": org, "loc": loc, "lvl": lvl, "yrs": yrs,
-             "hrs": total_hours, "rnk": rnk})
+    page, next_cursor = await crud.get_top_volunteers(db, limit, cursor)
+    for entry in page:
+        volunteers[len(volunteers) + 1] = json.dumps(leaderboard_entry_to_dict(entry))
+    set_next_cursor(response, next_cursor)
     return json.dumps(volunteers)
+
+
+async def check_get_leaderboard(
+        db: AsyncSession,
+        segment: str,
+        window: str,
+        segment_id: Optional[int],
+        limit: int,
+        offset: int,
+):
+    errors = {}
+    if segment not in crud.LEADERBOARD_SEGMENTS:
+        errors['segment'] = f"Segment must be one of {', '.join(crud.LEADERBOARD_SEGMENTS)}"
+    if window not in crud.LEADERBOARD_WINDOWS:
+        errors['window'] = f"Window must be one of {', '.join(crud.LEADERBOARD_WINDOWS)}"
+    if limit < 1 or limit > 100:
+        errors['limit'] = "Limit must be between 1 and 100"
+    if offset < 0:
+        errors['offset'] = "Offset cannot be negative"
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{json.dumps(errors)}"
+        )
+
+    rows, total = await crud.get_segmented_leaderboard(db, segment, window, segment_id, limit, offset)
+    volunteers = {}
+    for row in rows:
+        volunteers[len(volunteers) + offset + 1] = json.dumps(
+            {"name": row.name, "segment_id": row.segment_id, "rank": row.rank, "hrs": row.hours, "of": row.segment_total})
+    return json.dumps({"total": total, "volunteers": volunteers})
+
+
+@data.get('/api/data/get-leaderboard')
+async def get_leaderboard(
+        segment: str = 'global',
+        window: str = 'all',
+        segment_id: Optional[int] = None,
+        limit: int = 10,
+        offset: int = 0,
+        db: AsyncSession = Depends(get_read_session)
+):
+    return await check_get_leaderboard(db, segment, window, segment_id, limit, offset)
+
+
+async def check_get_stats(
+        db: AsyncSession,
+        scope: str,
+        scope_id: int,
+):
+    errors = {}
+    if scope not in crud.STAT_SCOPES:
+        errors['scope'] = f"Scope must be one of {', '.join(crud.STAT_SCOPES)}"
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{json.dumps(errors)}"
+        )
+
+    return json.dumps(await crud.get_stat_counters(db, scope, 0 if scope == 'global' else scope_id))
+
+
+@data.get('/api/data/get-stats')
+async def get_stats(
+        scope: str = 'global',
+        scope_id: int = 0,
+        db: AsyncSession = Depends(get_read_session)
+):
+    return await check_get_stats(db, scope, scope_id)
+
+
+async def check_get_hours_series(
+        db: AsyncSession,
+        granularity: str,
+        dimension: str,
+        dimension_id: int,
+        start: datetime.date,
+        end: datetime.date,
+):
+    errors = {}
+    if granularity not in crud.HOURS_ROLLUP_GRANULARITIES:
+        errors['granularity'] = f"Granularity must be one of {', '.join(crud.HOURS_ROLLUP_GRANULARITIES)}"
+    if dimension not in crud.HOURS_ROLLUP_DIMENSIONS:
+        errors['dimension'] = f"Dimension must be one of {', '.join(crud.HOURS_ROLLUP_DIMENSIONS)}"
+    bucket_days = 7 if granularity == 'week' else 1
+    if end < start:
+        errors['end'] = "End date cannot be before start date"
+    elif (end - start).days // bucket_days >= HOURS_SERIES_MAX_BUCKETS:
+        errors['end'] = f"A series can have at most {HOURS_SERIES_MAX_BUCKETS} buckets"
+    if errors:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{json.dumps(errors)}"
+        )
+
+    buckets = {bucket.bucket_start: bucket for bucket in
+               await crud.get_hours_series(db, granularity, dimension, 0 if dimension == 'global' else dimension_id, start, end)}
+    series = {}
+    bucket_start = crud.get_hours_rollup_bucket(granularity, start)
+    while bucket_start <= end:
+        bucket = buckets.get(bucket_start)
+        series[bucket_start.isoformat()] = {"hrs": bucket.hours if bucket else 0, "n": bucket.record_count if bucket else 0}
+        bucket_start += datetime.timedelta(days=bucket_days)
+    return json.dumps(series)
+
+
+@data.get('/api/data/hours-series')
+async def get_hours_series(
+        start: datetime.date,
+        end: datetime.date,
+        granularity: str = 'day',
+        dimension: str = 'global',
+        dimension_id: int = 0,
+        current_user: schemas.Principal = Security(get_current_user_required),
+        db: AsyncSession = Depends(get_read_session)
+):
+    return await check_get_hours_series(db, granularity, dimension, dimension_id, start, end)
+
+
+@data.get('/api/data/get-my-rank')
+async def get_my_rank(
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
+):
+    entry = await crud.get_leaderboard_entry(db, current_user.id)
+    if entry is None:
+        return json.dumps({"rank": None, "hrs": 0})
+    return json.dumps({"rank": entry.rank, "hrs": entry.hours})
+
+
+def leaderboard_entry_to_dict(
+        entry: models.LeaderboardEntry
+) -> dict:
+    if entry.start_date is None:
+        yrs = 0
+    else:
+        yrs = (datetime.datetime.now().date() - entry.start_date).days
+    return {"name": entry.name, "school": entry.school or "_", "org": entry.region or "_", "loc": entry.country or "_",
+            "lvl": entry.training_level or "_", "yrs": yrs, "hrs": entry.hours, "rnk": entry.user_rank or "_"}
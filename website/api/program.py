@@ -4,7 +4,7 @@ from fastapi import APIRouter, Security, Depends, status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
+from website.core import crud, models, schemas
 from website.core.database import get_session
 
 program = APIRouter()
@@ -17,9 +17,9 @@ async def check_create_team(
     errors = {}
     if len(info.name) < 6:
         errors['name'] = "Team name must be at least 6 characters"
-    program = await crud.get_program(db, id=info.program_id)
-    if program is None:
-        errors['program_id'] = "This program does not exist"
+    errors.update(await crud.check_references(db, {
+        'program_id': (models.Program.id, info.program_id, "This program does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -33,7 +33,7 @@ async def check_create_team(
 @program.post('/api/program/create-team')
 async def create_team(
         info: schemas.TeamCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['program']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['program']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_team(db, info)
@@ -59,7 +59,7 @@ async def check_create_role(
 @program.post('/api/team/create-role')
 async def create_role(
         info: schemas.RoleCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['team']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['team']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_role(db, info)
@@ -70,12 +70,10 @@ async def check_team_role_link(
         info: schemas.TeamRoleAssociation,
 ):
     errors = {}
-    team = await crud.get_team(db, id=info.team_id)
-    if team is None:
-        errors['event_id'] = "This team does not exist"
-    role = await crud.get_role(db, id=info.role_id)
-    if role is None:
-        errors['role_id'] = "This role does not exist"
+    errors.update(await crud.check_references(db, {
+        'team_id': (models.Team.id, info.team_id, "This team does not exist"),
+        'role_id': (models.Role.id, info.role_id, "This role does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -89,7 +87,7 @@ async def check_team_role_link(
 @program.post('/api/team/add-role-to-team')
 async def add_role_to_team(
         info: schemas.TeamRoleAssociation,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['team']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['team']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_team_role_link(db, info)
@@ -100,15 +98,11 @@ async def check_team_membership(
         info: schemas.TeamMembership,
 ):
     errors = {}
-    team = await crud.get_team(db, id=info.team_id)
-    if team is None:
-        errors['team_id'] = "This team does not exist"
-    role = await crud.get_role(db, id=info.role_id)
-    if role is None:  # TODO: role must be in team
-        errors['role_id'] = "This role does not exist"
-    user = await crud.get_user(db, id=info.user_id)
-    if user is None:
-        errors['user_id'] = "This user does not exist"
+    errors.update(await crud.check_references(db, {
+        'team_id': (models.Team.id, info.team_id, "This team does not exist"),
+        'role_id': (models.Role.id, info.role_id, "This role does not exist"),  # TODO: role must be in team
+        'user_id': (models.User.id, info.user_id, "This user does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -122,7 +116,7 @@ async def check_team_membership(
 @program.post('/api/team/add-user-to-team')
 async def add_user_to_team(
         info: schemas.TeamMembership,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['team']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['team']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_team_membership(db, info)
@@ -4,7 +4,7 @@ from fastapi import APIRouter, Security, Depends, status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
+from website.core import crud, models, schemas
 from website.core.database import get_session
 
 school = APIRouter()
@@ -30,7 +30,7 @@ async def check_create_event(
 @school.post('/api/school/create-event')
 async def create_school(
         info: schemas.EventCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['school']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['school']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_event(db, info)
@@ -56,7 +56,7 @@ async def check_create_role(
 @school.post('/api/school/create-role')
 async def create_role(
         info: schemas.RoleCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['school']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['school']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_role(db, info)
@@ -67,12 +67,10 @@ async def check_school_event_link(
         info: schemas.SchoolEventAssociation,
 ):
     errors = {}
-    school = await crud.get_school(db, id=info.school_id)
-    if school is None:
-        errors['school_id'] = "This school doesn't exist"
-    event = await crud.get_event(db, info.event_id)
-    if event is None:
-        errors['event_id'] = "This event does not exist"
+    errors.update(await crud.check_references(db, {
+        'school_id': (models.School.id, info.school_id, "This school doesn't exist"),
+        'event_id': (models.Event.id, info.event_id, "This event does not exist"),
+    }))
     if len(info.supervisor) < 3:
         errors['supervisor'] = "Supervisor must be greater than 3 characters"
     if len(info.supervisor_contact) < 5:
@@ -90,7 +88,7 @@ async def check_school_event_link(
 @school.post('/api/school/add-event-to-school')
 async def add_event_to_school(
         info: schemas.SchoolEventAssociation,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['school']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['school']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_school_event_link(db, info)
@@ -101,12 +99,10 @@ async def check_event_role_link(
         info: schemas.EventRoleAssociation,
 ):
     errors = {}
-    event = await crud.get_event(db, id=info.event_id)
-    if event is None:
-        errors['event_id'] = "This event does not exist"
-    role = await crud.get_role(db, id=info.role_id)
-    if role is None:
-        errors['role_id'] = "This role does not exist"
+    errors.update(await crud.check_references(db, {
+        'event_id': (models.Event.id, info.event_id, "This event does not exist"),
+        'role_id': (models.Role.id, info.role_id, "This role does not exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -120,7 +116,7 @@ async def check_event_role_link(
 @school.post('/api/school/add-role-to-event')
 async def add_role_to_event(
         info: schemas.EventRoleAssociation,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['school']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['school']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_event_role_link(db, info)
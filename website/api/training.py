@@ -4,7 +4,7 @@ from fastapi import APIRouter, Security, Depends, status, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
+from website.core import crud, models, schemas
 from website.core.database import get_session
 
 training = APIRouter()
@@ -17,9 +17,9 @@ async def check_log_training_record(
 ):
     errors = {}
     # TODO: datetime regex, training level regex
-    coach = await crud.get_user(db, id=info.coach_id)
-    if coach is None:  # TODO: or if is not coach
-        errors['coach_id'] = "The selected user is not a valid coach"
+    errors.update(await crud.check_references(db, {
+        'coach_id': (models.User.id, info.coach_id, "The selected user is not a valid coach"),  # TODO: or if is not coach
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -33,7 +33,7 @@ async def check_log_training_record(
 @training.post('/api/training/log-training-record')  # TODO: not an api access point, training will automatically create and generate training logs
 async def log_training_record(
         info: schemas.TrainingRecordCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['admin']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['admin']),
         db: AsyncSession = Depends(get_session),
 ):
     return await check_log_training_record(db, info, current_user.id)
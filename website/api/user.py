@@ -1,21 +1,26 @@
 import json
+from typing import Optional
 
-from fastapi import APIRouter, Security, Depends, status, HTTPException
+from fastapi import APIRouter, Security, Depends, status, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from website.api.auth import get_current_user_required
-from website.core import crud, schemas
-from website.core.database import get_session
+from website.api.data import set_next_cursor
+from website.core import crud, models, schemas
+from website.core.config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from website.core.database import get_read_session, get_session
+from website.core.loader import RequestLoader, get_loader
+from website.core.writer import write_queue
 
 user = APIRouter()
 
 
 @user.get('/api/user/current-user')  # TODO: only for testing only
 async def get_current_user(
-        current_user: schemas.User = Security(get_current_user_required),
-        db: AsyncSession = Depends(get_session)
+        current_user: schemas.Principal = Security(get_current_user_required),
+        loader: RequestLoader = Depends(get_loader)
 ):
-    user = await crud.get_user(db, id=current_user.id)
+    user = await loader.get_user(current_user.id, profile='profile')
     # user = await crud.get_user(db, id=1)
     filled_entries = 0
     for attr in schemas.UserUpdateProfile.from_orm(user).__dict__.keys():
@@ -44,9 +49,9 @@ async def check_update_profile(
         user_id: int,
 ):
     errors = {}
-    school = await crud.get_school(db, id=info.school_id)
-    if school is None and info.school_id is not None:
-        errors['school_id'] = "This school doesn't exist"
+    errors.update(await crud.check_references(db, {
+        'school_id': (models.School.id, info.school_id, "This school doesn't exist"),
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -60,7 +65,7 @@ async def check_update_profile(
 @user.post('/api/user/update-profile')
 async def update_profile(
         info: schemas.UserUpdateProfile,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_update_profile(db, info, current_user.id)
@@ -75,9 +80,12 @@ async def check_give_feedback(
     # TODO: datetime regex
     if len(info.content) < 5:
         errors['content'] = "Feedback content must be at least 5 characters"
-    to_user = await crud.get_user(db, id=info.to_user_id)
-    if to_user is None or to_user.id == user_id:
+    if info.to_user_id == user_id:
         errors['to_user_id'] = "Cannot give feedback to this user"
+    else:
+        errors.update(await crud.check_references(db, {
+            'to_user_id': (models.User.id, info.to_user_id, "Cannot give feedback to this user"),
+        }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
@@ -91,7 +99,7 @@ async def check_give_feedback(
 @user.post('/api/user/give-feedback')
 async def give_feedback(
         info: schemas.FeedbackCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_give_feedback(db, info, current_user.id)
@@ -112,31 +120,25 @@ async def check_log_volunteer_record(
         errors['all'] = "Volunteer record must be related to a team or event"
     elif info.event_id is not None and info.team_id is not None:
         errors['all'] = "Choose team or event, not both"
-    if info.event_id is not None:
-        event = await crud.get_event(db, id=info.event_id)
-        if event is None:
-            errors['event_id'] = "This event does not exist"
-    if info.team_id is not None:
-        team = await crud.get_team(db, id=info.team_id)
-        if team is None:
-            errors['team_id'] = "This team does not exist"
-    role = await crud.get_role(db, id=info.role_id)
-    if role is None:  # TODO: role must be related to event or team, and user must have access to that role
-        errors['role_id'] = "This role does not exist"
+    errors.update(await crud.check_references(db, {
+        'event_id': (models.Event.id, info.event_id, "This event does not exist"),
+        'team_id': (models.Team.id, info.team_id, "This team does not exist"),
+        'role_id': (models.Role.id, info.role_id, "This role does not exist"),  # TODO: role must be related to event or team, and user must have access to that role
+    }))
     if errors:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=f"{json.dumps(errors)}"
         )
 
-    await crud.create_volunteer_record(db, info, user_id)
+    await write_queue.submit(lambda session: crud.add_volunteer_record(session, info, user_id))
     return {"status": "success", "detail": "Logged volunteer record!"}
 
 
 @user.post('/api/user/log-volunteer-record')
 async def log_volunteer_record(
         info: schemas.VolunteerRecordCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_log_volunteer_record(db, info, current_user.id)
@@ -166,7 +168,7 @@ async def check_create_request(
 @user.post('/api/user/create-request')
 async def create_reqeust(
         info: schemas.RequestCreate,
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
         db: AsyncSession = Depends(get_session)
 ):
     return await check_create_request(db, info, current_user.id)
@@ -174,13 +176,18 @@ async def create_reqeust(
 
 @user.get('/api/user/get-teams-of-user')
 async def get_user_teams(
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
 ):
     teams = {}
     teams['0'] = "Select a team"
-    for team in await crud.get_teams_by_user(db, current_user.id):
+    page, next_cursor = await crud.get_teams_by_user(db, current_user.id, limit, cursor)
+    for team in page:
         teams[team.id] = team.name
+    set_next_cursor(response, next_cursor)
     if len(teams) == 1:
         teams['0'] = "No available teams"
     return json.dumps(teams)
@@ -188,12 +195,17 @@ async def get_user_teams(
 
 @user.get('/api/user/get-recent-records-of-user')
 async def get_recent_records_of_user(
-        current_user: schemas.User = Security(get_current_user_required, scopes=['volunteer']),
-        db: AsyncSession = Depends(get_session)
+        response: Response,
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+        cursor: Optional[str] = None,
+        current_user: schemas.Principal = Security(get_current_user_required, scopes=['volunteer']),
+        db: AsyncSession = Depends(get_read_session)
 ):
     records = {}
     count = 0
-    for entry in await crud.get_volunteer_records_by_user(db, current_user.id):
+    page, next_cursor = await crud.get_volunteer_records_by_user(db, current_user.id, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    for entry in page:
         count = count + 1
         if entry.team_id is None:
             activity = entry.event.name
@@ -205,7 +217,7 @@ async def get_recent_records_of_user(
 
 @user.get('/api/user/total-hours')
 async def get_total_hours(
-        current_user: schemas.User = Security(get_current_user_required),
-        db: AsyncSession = Depends(get_session)
+        current_user: schemas.Principal = Security(get_current_user_required),
+        db: AsyncSession = Depends(get_read_session)
 ):
     return await crud.get_user_total_hours(db, current_user.id)
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from website.core import crud, models, schemas
+from website.core.config import SQLITE_POOL_OVERFLOW, SQLITE_POOL_SIZE, WRITE_BATCH_DELAY_SECONDS, WRITE_BATCH_SIZE
+from website.core.database import Base, set_sqlite_pragmas
+from website.core.writer import WriteQueue
+
+USERS = 100
+
+
+async def seed(
+        session_factory,
+):
+    async with session_factory() as db:
+        db.add(models.Region(id=1, country="", name="Benchmark", abbreviation="B"))
+        db.add(models.School(id=1, abbreviation="B", name="Benchmark", region_id=1))
+        db.add(models.Event(id=1, name="Benchmark", date=datetime.date.today()))
+        db.add(models.Role(id=1, name="Benchmark"))
+        for user_id in range(1, USERS + 1):
+            db.add(models.User(id=user_id, email=f"{user_id}@benchmark", first_name="", last_name="", school_id=1))
+        await db.commit()
+
+
+async def run_writers(
+        write,
+        tasks: int,
+        writes: int,
+) -> dict:
+    latencies = []
+    errors = []
+
+    async def writer(task: int):
+        for i in range(writes):
+            info = schemas.VolunteerRecordCreate(date=datetime.datetime.utcnow(), hours=1, reflection="benchmark", event_id=1, role_id=1)
+            started = time.perf_counter()
+            try:
+                await write(info, task % USERS + 1)
+            except Exception as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[writer(task) for task in range(tasks)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "writes/s": round(tasks * writes / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "errors": len(errors),
+    }
+
+
+async def run(
+        tasks: int,
+        writes: int,
+):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directory, 'benchmark.db')}", future=True,
+                                     poolclass=AsyncAdaptedQueuePool, pool_size=SQLITE_POOL_SIZE, max_overflow=SQLITE_POOL_OVERFLOW)
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+        session_factory = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await seed(session_factory)
+
+        async def inline(info, user_id):
+            async with session_factory() as db:
+                await crud.create_volunteer_record(db, info, user_id)
+
+        print(f"{tasks} concurrent writers x {writes} volunteer records")
+        print("commit per request:", await run_writers(inline, tasks, writes))
+
+        queue = WriteQueue(session_factory, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_SECONDS)
+        queue.start()
+        print("write queue:       ", await run_writers(lambda info, user_id: queue.submit(
+            lambda db: crud.add_volunteer_record(db, info, user_id)), tasks, writes))
+        await queue.stop()
+        print("write queue stats: ", queue.stats())
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare volunteer record write throughput with and without the write queue on a scratch database")
+    parser.add_argument('--tasks', type=int, default=50)
+    parser.add_argument('--writes', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.tasks, args.writes))
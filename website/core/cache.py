@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from website.core.config import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS
+
+
+class TTLCache:
+    def __init__(
+            self,
+            maxsize: int,
+            ttl: float,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, owner, value), oldest first
+        self._owners: dict[Hashable, set] = {}  # owner -> keys, so one write can drop every entry it touches
+
+    def get(
+            self,
+            key: Hashable,
+    ) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses = self.misses + 1
+            return None
+        expires_at, owner, value = entry
+        if expires_at <= time.time():
+            self._remove(key)
+            self.misses = self.misses + 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits = self.hits + 1
+        return value
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            owner: Optional[Hashable] = None,
+            expires_at: Optional[float] = None,
+    ):
+        expires = time.time() + self.ttl
+        if expires_at is not None:
+            expires = min(expires, expires_at)
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires, owner, value)
+        if owner is not None:
+            self._owners.setdefault(owner, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate(
+            self,
+            key: Hashable,
+    ):
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate_owner(
+            self,
+            owner: Hashable,
+    ):
+        for key in self._owners.pop(owner, set()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._owners.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+    def _remove(
+            self,
+            key: Hashable,
+    ):
+        expires_at, owner, value = self._entries.pop(key)
+        if owner is not None:
+            keys = self._owners.get(owner)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._owners[owner]
+
+
+# token jti -> user, owned by user id
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
@@ -1,5 +1,56 @@
+DEBUG = False  # adds an X-Query-Count header with the SQL statements each request ran
 JWT_SECRET = ''
 JWT_ALG = "HS256"
 JWT_EXPIRE_SECONDS = 10800
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./database.db"
-SYNC_SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
\ No newline at end of file
+SYNC_SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
+# applied in this order to every new connection; journal_mode=WAL is persistent, the rest are per connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,  # negative is KiB, so 64 MiB per connection
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+}
+SQLITE_POOL_SIZE = 5  # connections are kept open so their page cache survives between requests
+SQLITE_POOL_OVERFLOW = 10
+READ_POOL_SIZE = 10  # read-only connections for GET routes, WAL lets these run alongside the writer
+READ_POOL_OVERFLOW = 20
+STARTUP_LOCK_TIMEOUT_SECONDS = 60  # how long a starting worker waits for another one's schema setup and migrations
+WRITE_BATCH_SIZE = 100
+WRITE_BATCH_DELAY_SECONDS = 0.005  # how long the writer waits for more operations before committing a batch
+PRINCIPAL_CACHE_SIZE = 10000
+PRINCIPAL_CACHE_TTL_SECONDS = 300
+CACHE_BUS_BACKEND = 'sqlite'  # 'sqlite' polls the cache_event table, 'redis' needs requirements-redis.txt
+CACHE_BUS_REDIS_URL = "redis://localhost:6379/0"
+CACHE_BUS_POLL_SECONDS = 1.0  # how long another worker's caches can lag a write made here
+CACHE_BUS_MAX_LAG_SECONDS = 30  # a worker that can't poll for this long drops its caches instead of serving older entries
+CACHE_EVENT_RETENTION_SECONDS = 3600  # a worker that falls further behind than this drops its caches when it catches up
+
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_QUEUE_SIZE = 64
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 2
+
+LOGIN_EMAIL_BURST = 5
+LOGIN_EMAIL_REFILL_SECONDS = 60
+LOGIN_IP_BURST = 200  # failed attempts only, and many users can share one school NAT
+LOGIN_IP_REFILL_SECONDS = 0.2
+LOGIN_THROTTLE_MAX_KEYS = 100000
+CLIENT_IP_HEADER = None  # e.g. "X-Forwarded-For", only when every request comes through proxies that set it
+TRUSTED_PROXY_COUNT = 1  # proxies appending to CLIENT_IP_HEADER, the client address is this many entries from the end
+
+REFRESH_TOKEN_EXPIRE_SECONDS = 2592000
+
+HOURS_SUMMARY_REBUILD_SECONDS = 86400
+LEADERBOARD_REBUILD_SECONDS = 300
+STAT_COUNTER_RECONCILE_SECONDS = 3600
+ARCHIVE_HORIZON_DAYS = 730  # keep above 365 so the past-year and term windows only read volunteer_record
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_INTERVAL_SECONDS = 86400
+HOURS_SERIES_MAX_BUCKETS = 366
+TERM_START_DATES = ((1, 1), (8, 1))  # (month, day) each school term begins
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
@@ -1,25 +1,144 @@
+import base64
+import calendar
 import datetime
+import json
 from typing import Optional
 
-from sqlalchemy import desc, func
+from sqlalchemy import DateTime, case, delete, desc, exists, func, insert, literal, text, tuple_, union_all, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 
 from website.core import models, schemas
-
-
-# TODO: replace add statements with execute insert (maybe)?
+from website.core.config import ARCHIVE_BATCH_SIZE, ARCHIVE_HORIZON_DAYS, TERM_START_DATES
+from website.core.invalidation import cache_bus
+from website.core.refdata import reference_data
+
+
+# relationships default to lazy='raise', so every caller picks the graph it actually renders
+LOAD_PROFILES = {
+    'auth': (
+        selectinload(models.User.permissions),
+        raiseload('*'),
+    ),
+    'profile': (
+        joinedload(models.User.school).joinedload(models.School.region),
+        raiseload('*'),
+    ),
+    'full': (
+        joinedload(models.User.school).joinedload(models.School.region),
+        selectinload(models.User.teams),
+        selectinload(models.User.traits),
+        selectinload(models.User.feedback_received),
+        selectinload(models.User.feedback_given),
+        selectinload(models.User.training_records),
+        selectinload(models.User.volunteer_records),
+        selectinload(models.User.requests),
+        selectinload(models.User.payments),
+        selectinload(models.User.permissions),
+    ),
+}
+
+
+def load_profile(
+        profile: Optional[str],
+) -> tuple:
+    if profile is None:
+        return ()
+    return LOAD_PROFILES[profile]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(
+        values: list,
+) -> str:
+    values = [value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(
+        cursor: str,
+        keys: list,
+) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise InvalidCursor(cursor)
+        decoded = []
+        for key, value in zip(keys, values):
+            python_type = key.type.python_type
+            if python_type in (datetime.date, datetime.datetime):
+                decoded.append(python_type.fromisoformat(value))
+            else:
+                decoded.append(python_type(value))
+        return decoded
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+async def paginate(
+        db: AsyncSession,
+        statement,
+        keys: list,
+        limit: int,
+        cursor: Optional[str] = None,
+        descending: bool = False,
+) -> tuple[list, Optional[str]]:
+    # keyset pagination: keys must be unique together, and the cursor holds the keys of the last row served
+    if cursor is not None:
+        after = tuple_(*[literal(value, key.type) for key, value in zip(keys, decode_cursor(cursor, keys))])
+        statement = statement.filter(tuple_(*keys) < after if descending else tuple_(*keys) > after)
+    order = [desc(key) for key in keys] if descending else keys
+    result = await db.execute(statement.order_by(*order).limit(limit + 1))
+    items = result.scalars().all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], key.key) for key in keys])
+
+
+async def check_references(
+        db: AsyncSession,
+        references: dict[str, tuple],
+) -> dict[str, str]:
+    # {field: (column, value, message)} -> {field: message} for each value not found in its column, all in one
+    # SELECT of EXISTS subqueries so nothing is hydrated; None values are optional references and are skipped,
+    # and values found in the reference data cache never reach the database
+    snapshot = await reference_data.get(db)
+    checks = {field: (column, value, message) for field, (column, value, message) in references.items()
+              if value is not None and snapshot.lookup(column, value) is None}
+    if not checks:
+        return {}
+    result = await db.execute(select(*[exists().where(column == value).label(field) for field, (column, value, message) in checks.items()]))
+    found = result.first()._mapping
+    return {field: message for field, (column, value, message) in checks.items() if not found[field]}
+
+
+async def get_by_ids(
+        db: AsyncSession,
+        model,
+        ids: list[int],
+        options: tuple = (),
+) -> list:
+    result = await db.execute(select(model).options(*options).filter(model.id.in_(ids)))
+    return result.unique().scalars().all()
 
 
 async def get_user(
         db: AsyncSession,
         id: Optional[int] = None,
         email: Optional[str] = None,
+        profile: Optional[str] = None,
 ) -> Optional[models.User]:
+    options = load_profile(profile)
     if id is not None:
-        result = await db.execute(select(models.User).filter(models.User.id == id))
+        result = await db.execute(select(models.User).options(*options).filter(models.User.id == id))
     elif email is not None:
-        result = await db.execute(select(models.User).filter(models.User.email == email))
+        result = await db.execute(select(models.User).options(*options).filter(models.User.email == email))
     else:
         return None
     return result.scalars().first()
@@ -28,29 +147,377 @@ async def get_user(
 async def get_top_volunteers(
         db: AsyncSession,
         limit: int,
-        offset: int,
-) -> list[models.User]:
-    result = await db.execute(select(models.User).order_by(desc(
-        select(func.sum(models.VolunteerRecord.hours)).filter(models.VolunteerRecord.user_id == models.User.id))).limit(limit).offset(offset))
-    return result.scalars().all()
+        cursor: Optional[str] = None,
+) -> tuple[list[models.LeaderboardEntry], Optional[str]]:
+    return await paginate(db, select(models.LeaderboardEntry), [models.LeaderboardEntry.rank, models.LeaderboardEntry.user_id], limit, cursor)
+
+
+async def get_leaderboard_entry(
+        db: AsyncSession,
+        user_id: int,
+) -> Optional[models.LeaderboardEntry]:
+    result = await db.execute(select(models.LeaderboardEntry).filter(models.LeaderboardEntry.user_id == user_id))
+    return result.scalars().first()
+
+
+async def rebuild_leaderboard_snapshot(
+        db: AsyncSession,
+):
+    hours = func.coalesce(models.UserHoursSummary.total_hours, 0)
+    ranked = (select(
+        models.User.id,
+        func.rank().over(order_by=desc(hours)),
+        hours,
+        models.User.first_name + " " + models.User.last_name,
+        models.School.abbreviation,
+        models.Region.abbreviation,
+        models.Region.country,
+        models.User.training_level,
+        models.User.rank,
+        models.User.start_date,
+        literal(datetime.datetime.utcnow(), DateTime),
+    ).select_from(models.User)
+        .outerjoin(models.UserHoursSummary, models.UserHoursSummary.user_id == models.User.id)
+        .outerjoin(models.School, models.School.id == models.User.school_id)
+        .outerjoin(models.Region, models.Region.id == models.School.region_id))
+    await db.execute(delete(models.LeaderboardEntry))
+    await db.execute(insert(models.LeaderboardEntry).from_select(
+        ['user_id', 'rank', 'hours', 'name', 'school', 'region', 'country', 'training_level', 'user_rank', 'start_date', 'built'], ranked))
+    await db.commit()
+
+
+LEADERBOARD_SEGMENTS = ('global', 'school', 'region', 'program')
+LEADERBOARD_WINDOWS = ('all', '30d', 'term')
+
+
+def get_leaderboard_window_start(
+        window: str,
+) -> Optional[datetime.datetime]:
+    now = datetime.datetime.utcnow()
+    if window == '30d':
+        return now - datetime.timedelta(days=30)
+    if window == 'term':
+        starts = [datetime.datetime(year, month, day) for year in (now.year - 1, now.year) for month, day in TERM_START_DATES]
+        return max(start for start in starts if start <= now)
+    return None
+
+
+async def get_segmented_leaderboard(
+        db: AsyncSession,
+        segment: str,
+        window: str,
+        segment_id: Optional[int] = None,
+        limit: int = 10,
+        offset: int = 0,
+) -> tuple[list, int]:
+    start = get_leaderboard_window_start(window)
+    if segment == 'school':
+        key = models.User.school_id
+    elif segment == 'region':
+        key = models.School.region_id
+    elif segment == 'program':
+        key = models.Team.program_id
+    else:
+        key = literal(0)
+
+    if start is None and segment != 'program':
+        # all-time totals per user are already summed in user_hours_summary
+        per_user = (select(models.User.id.label('user_id'), key.label('segment_id'), models.UserHoursSummary.total_hours.label('hours'))
+                    .select_from(models.UserHoursSummary).join(models.User, models.User.id == models.UserHoursSummary.user_id))
+    else:
+        records = get_volunteer_record_source(start)
+        per_user = (select(records.c.user_id.label('user_id'), key.label('segment_id'), func.sum(records.c.hours).label('hours'))
+                    .select_from(records).join(models.User, models.User.id == records.c.user_id)
+                    .group_by(records.c.user_id, key))
+    if segment == 'region':
+        per_user = per_user.join(models.School, models.School.id == models.User.school_id)
+    elif segment == 'program':
+        per_user = per_user.join(models.Team, models.Team.id == records.c.team_id)
+    if segment_id is not None:
+        per_user = per_user.filter(key == segment_id)
+    elif segment != 'global':
+        per_user = per_user.filter(key != None)
+    per_user = per_user.subquery()
+
+    ranked = select(
+        per_user.c.user_id,
+        per_user.c.segment_id,
+        per_user.c.hours,
+        func.rank().over(partition_by=per_user.c.segment_id, order_by=desc(per_user.c.hours)).label('rank'),
+        func.count().over(partition_by=per_user.c.segment_id).label('segment_total'),
+    ).subquery()
+    result = await db.execute(select(
+        ranked,
+        (models.User.first_name + " " + models.User.last_name).label('name'),
+        func.count().over().label('total'),
+    ).join(models.User, models.User.id == ranked.c.user_id).order_by(ranked.c.segment_id, ranked.c.rank, ranked.c.user_id).limit(limit).offset(offset))
+    rows = result.all()
+    if rows:
+        return rows, rows[0].total
+    result = await db.execute(select(func.count()).select_from(ranked))
+    return rows, result.scalars().first()
 
 
 async def get_volunteer_count(  # TODO: only active volunteers
         db: AsyncSession,
+        scope: str = 'global',
+        scope_id: int = 0,
 ) -> int:
-    result = await db.execute(
-        select(func.count(models.UserPermissions.permission_name)).filter(models.UserPermissions.permission_name == "volunteer"))
-    return result.scalars().first()
+    return await get_stat_counter(db, 'volunteer_count', scope, scope_id)
 
 
 async def get_user_total_hours(
         db: AsyncSession,
         user_id: int,
 ) -> int:
-    result = await db.execute(select(func.sum(models.VolunteerRecord.hours)).filter(models.VolunteerRecord.user_id == user_id))
+    result = await db.execute(select(models.UserHoursSummary.total_hours).filter(models.UserHoursSummary.user_id == user_id))
     return result.scalars().first()
 
 
+async def get_user_hours_summary(
+        db: AsyncSession,
+        user_id: int,
+) -> Optional[models.UserHoursSummary]:
+    result = await db.execute(select(models.UserHoursSummary).filter(models.UserHoursSummary.user_id == user_id))
+    return result.scalars().first()
+
+
+def is_past_year(
+        date: datetime.datetime,
+) -> bool:
+    return date.replace(tzinfo=None) > datetime.datetime.utcnow() - datetime.timedelta(days=365)
+
+
+async def add_to_user_hours_summary(
+        db: AsyncSession,
+        user_id: int,
+        hours: int,
+        date: datetime.datetime,
+):
+    # no commit, runs in the transaction that inserts the record
+    recent_hours = hours if is_past_year(date) else 0
+    statement = sqlite_insert(models.UserHoursSummary).values(user_id=user_id, total_hours=hours, recent_hours=recent_hours, record_count=1)
+    await db.execute(statement.on_conflict_do_update(index_elements=[models.UserHoursSummary.user_id], set_={
+        'total_hours': models.UserHoursSummary.total_hours + statement.excluded.total_hours,
+        'recent_hours': models.UserHoursSummary.recent_hours + statement.excluded.recent_hours,
+        'record_count': models.UserHoursSummary.record_count + 1,
+    }))
+
+
+async def rebuild_user_hours_summary(
+        db: AsyncSession,
+):
+    earliest_date = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+    source = get_volunteer_record_source()
+    records = select(
+        source.c.user_id,
+        func.sum(source.c.hours),
+        func.sum(case((source.c.date > earliest_date, source.c.hours), else_=0)),
+        func.count(source.c.id),
+    ).filter(source.c.user_id != None).group_by(source.c.user_id)
+    await db.execute(delete(models.UserHoursSummary))
+    await db.execute(insert(models.UserHoursSummary).from_select(['user_id', 'total_hours', 'recent_hours', 'record_count'], records))
+    await db.commit()
+
+
+STAT_SCOPES = ('global', 'school', 'region')
+STAT_COUNTERS = ('volunteer_count', 'hours', 'hours_past_year', 'record_count')
+
+
+async def get_stat_counter(
+        db: AsyncSession,
+        name: str,
+        scope: str = 'global',
+        scope_id: int = 0,
+) -> int:
+    result = await db.execute(select(models.StatCounter.value).filter(
+        models.StatCounter.scope == scope, models.StatCounter.scope_id == scope_id, models.StatCounter.name == name))
+    return result.scalars().first() or 0
+
+
+async def get_stat_counters(
+        db: AsyncSession,
+        scope: str = 'global',
+        scope_id: int = 0,
+) -> dict[str, int]:
+    result = await db.execute(select(models.StatCounter.name, models.StatCounter.value).filter(
+        models.StatCounter.scope == scope, models.StatCounter.scope_id == scope_id))
+    counters = dict.fromkeys(STAT_COUNTERS, 0)
+    counters.update(result.all())
+    return counters
+
+
+async def get_user_stat_scopes(
+        db: AsyncSession,
+        user_id: int,
+) -> list[tuple[str, int]]:
+    result = await db.execute(select(models.User.school_id, models.School.region_id).outerjoin(
+        models.School, models.School.id == models.User.school_id).filter(models.User.id == user_id))
+    row = result.first()
+    scopes = [('global', 0)]
+    if row is not None and row.school_id is not None:
+        scopes.append(('school', row.school_id))
+    if row is not None and row.region_id is not None:
+        scopes.append(('region', row.region_id))
+    return scopes
+
+
+async def add_to_stat_counters(
+        db: AsyncSession,
+        scopes: list[tuple[str, int]],
+        deltas: dict[str, int],
+):
+    # no commit, runs in the transaction that makes the change being counted
+    rows = [{'scope': scope, 'scope_id': scope_id, 'name': name, 'value': value}
+            for scope, scope_id in scopes for name, value in deltas.items() if value]
+    if not rows:
+        return
+    statement = sqlite_insert(models.StatCounter)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[models.StatCounter.scope, models.StatCounter.scope_id, models.StatCounter.name],
+        set_={'value': models.StatCounter.value + statement.excluded.value}), rows)
+
+
+async def get_user_stat_deltas(
+        db: AsyncSession,
+        user_id: int,
+) -> dict[str, int]:
+    # what one user contributes to the counters of their school and region
+    summary = await get_user_hours_summary(db, user_id)
+    result = await db.execute(select(func.count()).select_from(models.UserPermissions).filter(
+        models.UserPermissions.user_id == user_id, models.UserPermissions.permission_name == "volunteer"))
+    deltas = {'volunteer_count': result.scalars().first()}
+    if summary is not None:
+        deltas.update(hours=summary.total_hours, hours_past_year=summary.recent_hours, record_count=summary.record_count)
+    return deltas
+
+
+async def reconcile_stat_counters(
+        db: AsyncSession,
+):
+    # one pass over the records per school, then region and global totals are summed from those rows
+    earliest_date = datetime.datetime.utcnow() - datetime.timedelta(days=365)
+    source = get_volunteer_record_source()
+    records = select(
+        models.User.school_id,
+        func.sum(source.c.hours).label('hours'),
+        func.sum(case((source.c.date > earliest_date, source.c.hours), else_=0)).label('hours_past_year'),
+        func.count().label('record_count'),
+    ).select_from(source).outerjoin(models.User, models.User.id == source.c.user_id).group_by(models.User.school_id).subquery()
+    volunteers = select(models.User.school_id, func.count().label('volunteer_count')).select_from(models.UserPermissions).join(
+        models.User, models.User.id == models.UserPermissions.user_id).filter(models.UserPermissions.permission_name == "volunteer").group_by(
+        models.User.school_id).subquery()
+    counters = []
+    for source, names in ((records, ('hours', 'hours_past_year', 'record_count')), (volunteers, ('volunteer_count',))):
+        per_school = select(source, models.School.region_id).outerjoin(models.School, models.School.id == source.c.school_id).cte()
+        for name in names:
+            value = per_school.c[name]
+            counters += [
+                select(literal('global'), literal(0), literal(name), func.coalesce(func.sum(value), 0)),
+                select(literal('school'), per_school.c.school_id, literal(name), value).filter(per_school.c.school_id != None),
+                select(literal('region'), per_school.c.region_id, literal(name), func.sum(value)).filter(
+                    per_school.c.region_id != None).group_by(per_school.c.region_id),
+            ]
+    await db.execute(delete(models.StatCounter))
+    await db.execute(insert(models.StatCounter).from_select(['scope', 'scope_id', 'name', 'value'], union_all(*counters)))
+    await db.commit()
+
+
+HOURS_ROLLUP_GRANULARITIES = ('day', 'week')
+HOURS_ROLLUP_DIMENSIONS = ('global', 'school', 'region', 'program', 'team', 'event')
+
+
+def get_hours_rollup_bucket(
+        granularity: str,
+        date: datetime.date,
+) -> datetime.date:
+    if granularity == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    return date
+
+
+async def add_to_hours_rollup(
+        db: AsyncSession,
+        scopes: list[tuple[str, int]],
+        team_id: Optional[int],
+        event_id: Optional[int],
+        hours: int,
+        date: datetime.datetime,
+):
+    # no commit, runs in the transaction that inserts the record; scopes come from get_user_stat_scopes
+    dimensions = list(scopes)
+    if team_id is not None:
+        dimensions.append(('team', team_id))
+        result = await db.execute(select(models.Team.program_id).filter(models.Team.id == team_id))
+        program_id = result.scalars().first()
+        if program_id is not None:
+            dimensions.append(('program', program_id))
+    if event_id is not None:
+        dimensions.append(('event', event_id))
+    rows = [{'granularity': granularity, 'dimension': dimension, 'dimension_id': dimension_id,
+             'bucket_start': get_hours_rollup_bucket(granularity, date.date()), 'hours': hours, 'record_count': 1}
+            for granularity in HOURS_ROLLUP_GRANULARITIES for dimension, dimension_id in dimensions]
+    statement = sqlite_insert(models.HoursRollup)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[models.HoursRollup.granularity, models.HoursRollup.dimension, models.HoursRollup.dimension_id, models.HoursRollup.bucket_start],
+        set_={'hours': models.HoursRollup.hours + statement.excluded.hours, 'record_count': models.HoursRollup.record_count + 1}), rows)
+
+
+async def has_hours_rollup(
+        db: AsyncSession,
+) -> bool:
+    result = await db.execute(select(models.HoursRollup.hours).limit(1))
+    return result.first() is not None
+
+
+async def rebuild_hours_rollup(
+        db: AsyncSession,
+):
+    # day buckets come from one materialized pass over the records, week buckets are summed from the day buckets
+    source = get_volunteer_record_source()
+    records = select(
+        source.c.hours,
+        func.date(source.c.date).label('day'),
+        models.User.school_id,
+        models.School.region_id,
+        models.Team.program_id,
+        source.c.team_id,
+        source.c.event_id,
+    ).select_from(source).outerjoin(models.User, models.User.id == source.c.user_id).outerjoin(
+        models.School, models.School.id == models.User.school_id).outerjoin(
+        models.Team, models.Team.id == source.c.team_id).cte()
+    days = []
+    for dimension, key in (('global', literal(0)), ('school', records.c.school_id), ('region', records.c.region_id),
+                           ('program', records.c.program_id), ('team', records.c.team_id), ('event', records.c.event_id)):
+        group_by = [records.c.day] if dimension == 'global' else [key, records.c.day]
+        days.append(select(literal('day'), literal(dimension), key, records.c.day, func.sum(records.c.hours), func.count()).filter(
+            key != None).group_by(*group_by))
+    week = func.date(models.HoursRollup.bucket_start, 'weekday 0', '-6 days')
+    weeks = select(literal('week'), models.HoursRollup.dimension, models.HoursRollup.dimension_id, week, func.sum(models.HoursRollup.hours),
+                   func.sum(models.HoursRollup.record_count)).filter(models.HoursRollup.granularity == 'day').group_by(
+        models.HoursRollup.dimension, models.HoursRollup.dimension_id, week)
+    columns = ['granularity', 'dimension', 'dimension_id', 'bucket_start', 'hours', 'record_count']
+    await db.execute(delete(models.HoursRollup))
+    await db.execute(insert(models.HoursRollup).from_select(columns, union_all(*days)))
+    await db.execute(insert(models.HoursRollup).from_select(columns, weeks))
+    await db.commit()
+
+
+async def get_hours_series(
+        db: AsyncSession,
+        granularity: str,
+        dimension: str,
+        dimension_id: int,
+        start: datetime.date,
+        end: datetime.date,
+) -> list[models.HoursRollup]:
+    result = await db.execute(select(models.HoursRollup).filter(
+        models.HoursRollup.granularity == granularity, models.HoursRollup.dimension == dimension,
+        models.HoursRollup.dimension_id == dimension_id, models.HoursRollup.bucket_start >= get_hours_rollup_bucket(granularity, start),
+        models.HoursRollup.bucket_start <= end).order_by(models.HoursRollup.bucket_start))
+    return result.scalars().all()
+
+
 async def create_user(
         db: AsyncSession,
         user: schemas.UserCreate
@@ -58,7 +525,6 @@ async def create_user(
     new_user = models.User(email=user.email, first_name=user.first_name, last_name=user.last_name, password=user.password)
     db.add(new_user)
     await db.commit()
-    await db.refresh(new_user)
     return new_user
 
 
@@ -69,6 +535,7 @@ async def update_user_password(
     updated_user = await get_user(db, email=user.email)
     updated_user.password = user.new_password
     await db.commit()
+    await cache_bus.publish('principal', str(updated_user.id))
     await db.refresh(updated_user)
     return updated_user
 
@@ -79,11 +546,21 @@ async def update_user_profile(
         id: int
 ) -> models.User:
     user = await get_user(db, id)
+    moved_school = info.school_id is not None and info.school_id != user.school_id
+    if moved_school:
+        old_scopes = await get_user_stat_scopes(db, id)
     args = locals()
     for k, v in dict(args.items()).get('info'):
         if v is not None and v != "":
             setattr(user, k, v)
+    if moved_school:
+        # the user's hours and volunteer count follow them to the new school and region
+        await db.flush()
+        deltas = await get_user_stat_deltas(db, id)
+        await add_to_stat_counters(db, old_scopes[1:], {name: -value for name, value in deltas.items()})
+        await add_to_stat_counters(db, (await get_user_stat_scopes(db, id))[1:], deltas)
     await db.commit()
+    await cache_bus.publish('principal', str(user.id))
     await db.refresh(user)
     return user
 
@@ -94,11 +571,79 @@ async def create_user_permission_link(
 ) -> models.UserPermissions:
     new_link = models.UserPermissions(user_id=info.user_id, permission_name=info.permission_name)
     db.add(new_link)
+    if info.permission_name == "volunteer":
+        await add_to_stat_counters(db, await get_user_stat_scopes(db, info.user_id), {'volunteer_count': 1})
     await db.commit()
-    await db.refresh(new_link)
+    await cache_bus.publish('principal', str(info.user_id))
     return new_link
 
 
+async def get_refresh_token(
+        db: AsyncSession,
+        token_hash: str,
+) -> Optional[models.RefreshToken]:
+    result = await db.execute(select(models.RefreshToken).filter(models.RefreshToken.token_hash == token_hash))
+    return result.scalars().first()
+
+
+async def create_refresh_token(
+        db: AsyncSession,
+        info: schemas.RefreshTokenCreate,
+        replaces: Optional[models.RefreshToken] = None,
+) -> Optional[models.RefreshToken]:
+    if replaces is not None:
+        # only one caller may rotate a given token
+        result = await db.execute(update(models.RefreshToken).where(models.RefreshToken.id == replaces.id, models.RefreshToken.revoked == False)
+                                  .values(revoked=True))
+        if result.rowcount == 0:
+            await db.rollback()
+            return None
+    new_token = models.RefreshToken(user_id=info.user_id, token_hash=info.token_hash, created=info.created, expires=info.expires, revoked=False)
+    db.add(new_token)
+    await db.commit()
+    return new_token
+
+
+async def revoke_refresh_token(
+        db: AsyncSession,
+        token_hash: str,
+):
+    await db.execute(update(models.RefreshToken).where(models.RefreshToken.token_hash == token_hash).values(revoked=True))
+    await db.commit()
+
+
+async def revoke_refresh_tokens_by_user(
+        db: AsyncSession,
+        user_id: int,
+):
+    await db.execute(update(models.RefreshToken).where(models.RefreshToken.user_id == user_id).values(revoked=True))
+    await db.commit()
+
+
+async def get_active_revoked_tokens(
+        db: AsyncSession,
+) -> list[models.RevokedToken]:
+    result = await db.execute(select(models.RevokedToken).filter(models.RevokedToken.expires > datetime.datetime.utcnow()))
+    return result.scalars().all()
+
+
+async def create_revoked_token(
+        db: AsyncSession,
+        info: schemas.RevokedToken,
+) -> models.RevokedToken:
+    new_revoked_token = await db.merge(models.RevokedToken(jti=info.jti, expires=info.expires))
+    await db.commit()
+    await cache_bus.publish('revoked', f"{info.jti} {calendar.timegm(info.expires.utctimetuple())}")
+    return new_revoked_token
+
+
+async def delete_expired_revoked_tokens(
+        db: AsyncSession,
+):
+    await db.execute(delete(models.RevokedToken).where(models.RevokedToken.expires <= datetime.datetime.utcnow()))
+    await db.commit()
+
+
 async def get_permission(
         db: AsyncSession,
         name: Optional[str] = None,
@@ -110,17 +655,54 @@ async def get_permission(
     return result.scalars().first()
 
 
+async def get_permissions(
+        db: AsyncSession,
+) -> list[models.Permission]:
+    result = await db.execute(select(models.Permission))
+    return result.scalars().all()
+
+
+async def get_next_permission_bit(
+        db: AsyncSession,
+) -> int:
+    result = await db.execute(select(func.max(models.Permission.bit)))
+    highest = result.scalars().first()
+    return 0 if highest is None else highest + 1
+
+
 async def create_permission(
         db: AsyncSession,
         info: schemas.Permission,
 ) -> models.Permission:
-    new_permission = models.Permission(name=info.name)
+    new_permission = models.Permission(name=info.name, bit=await get_next_permission_bit(db))
     db.add(new_permission)
     await db.commit()
-    await db.refresh(new_permission)
+    await cache_bus.publish('permission', f"{new_permission.name} {new_permission.bit}")
     return new_permission
 
 
+async def add_permission_if_missing(
+        db: AsyncSession,
+        name: str,
+        bit: int,
+) -> bool:
+    # no commit, and a permission that already exists is left as it is
+    result = await db.execute(insert(models.Permission).prefix_with('OR IGNORE').values(name=name, bit=bit))
+    return result.rowcount == 1
+
+
+async def assign_permission_bits(
+        db: AsyncSession,
+):
+    # permissions created before scope masks existed
+    result = await db.execute(select(models.Permission).filter(models.Permission.bit == None).order_by(text('rowid')))
+    next_bit = await get_next_permission_bit(db)
+    for permission in result.scalars().all():
+        permission.bit = next_bit
+        next_bit = next_bit + 1
+    await db.commit()
+
+
 async def get_region(
         db: AsyncSession,
         id: Optional[int] = None,
@@ -142,7 +724,7 @@ async def create_region(
     new_region = models.Region(country=info.country, name=info.name, abbreviation=info.abbreviation)
     db.add(new_region)
     await db.commit()
-    await db.refresh(new_region)
+    await cache_bus.publish('refdata')
     return new_region
 
 
@@ -164,7 +746,7 @@ async def create_program(
     new_program = models.Program(name=info.name, region_id=info.region_id)
     db.add(new_program)
     await db.commit()
-    await db.refresh(new_program)
+    await cache_bus.publish('refdata')
     return new_program
 
 
@@ -192,7 +774,7 @@ async def create_school(
     new_school = models.School(abbreviation=info.abbreviation, name=info.name, region_id=info.region_id)
     db.add(new_school)
     await db.commit()
-    await db.refresh(new_school)
+    await cache_bus.publish('refdata')
     return new_school
 
 
@@ -207,11 +789,12 @@ async def get_event(
 async def get_recent_events_by_school(
         db: AsyncSession,
         school_id: int,
-) -> list[models.Event]:
-    result = await db.execute(
-        select(models.Event).where(models.Event.schools.any(models.SchoolEventAssociation.school_id == school_id)).filter(
-            models.Event.date < datetime.datetime.utcnow()).order_by(desc(models.Event.date)))
-    return result.scalars().all()
+        limit: int,
+        cursor: Optional[str] = None,
+) -> tuple[list[models.Event], Optional[str]]:
+    statement = select(models.Event).where(models.Event.schools.any(models.SchoolEventAssociation.school_id == school_id)).filter(
+        models.Event.date < datetime.datetime.utcnow())
+    return await paginate(db, statement, [models.Event.date, models.Event.id], limit, cursor, descending=True)
 
 
 async def create_event(
@@ -221,7 +804,6 @@ async def create_event(
     new_event = models.Event(name=info.name, date=info.date)
     db.add(new_event)
     await db.commit()
-    await db.refresh(new_event)
     return new_event
 
 
@@ -239,9 +821,11 @@ async def get_team(
 async def get_teams_by_user(
         db: AsyncSession,
         user_id: int,
-) -> list[models.Team]:
-    result = await db.execute(select(models.Team).where(models.Team.members.any(models.TeamMembership.user_id == user_id)))
-    return result.scalars().all()
+        limit: int,
+        cursor: Optional[str] = None,
+) -> tuple[list[models.Team], Optional[str]]:
+    statement = select(models.Team).where(models.Team.members.any(models.TeamMembership.user_id == user_id))
+    return await paginate(db, statement, [models.Team.id], limit, cursor)
 
 
 async def create_team(
@@ -251,7 +835,6 @@ async def create_team(
     new_team = models.Team(name=info.name, program_id=info.program_id)
     db.add(new_team)
     await db.commit()
-    await db.refresh(new_team)
     return new_team
 
 
@@ -266,20 +849,39 @@ async def get_role(
     return result.scalars().first()
 
 
-async def get_roles_by_team(
+async def get_role_ids_by_team(
         db: AsyncSession,
         team_id: int,
-) -> list[models.Role]:
-    result = await db.execute(select(models.Role).where(models.Role.teams.any(models.TeamRoleAssociation.team_id == team_id)))
-    return result.scalars().all()
+        limit: int,
+        cursor: Optional[str] = None,
+) -> tuple[list[int], Optional[str]]:
+    # read from the association's primary key alone, names come from the reference data cache
+    statement = select(models.TeamRoleAssociation).where(models.TeamRoleAssociation.team_id == team_id)
+    links, next_cursor = await paginate(db, statement, [models.TeamRoleAssociation.role_id], limit, cursor)
+    return [link.role_id for link in links], next_cursor
 
 
-async def get_roles_by_event(
+async def get_role_ids_by_event(
         db: AsyncSession,
         event_id: int,
-) -> list[models.Role]:
-    result = await db.execute(select(models.Role).where(models.Role.events.any(models.EventRoleAssociation.event_id == event_id)))
-    return result.scalars().all()
+        limit: int,
+        cursor: Optional[str] = None,
+) -> tuple[list[int], Optional[str]]:
+    statement = select(models.EventRoleAssociation).where(models.EventRoleAssociation.event_id == event_id)
+    links, next_cursor = await paginate(db, statement, [models.EventRoleAssociation.role_id], limit, cursor)
+    return [link.role_id for link in links], next_cursor
+
+
+async def get_role_names(
+        db: AsyncSession,
+        ids: list[int],
+) -> dict[int, str]:
+    roles = (await reference_data.get(db)).roles
+    names = {id: roles[id].name for id in ids if id in roles}
+    missing = [id for id in ids if id not in names]
+    if missing:  # created by another worker since the cache was loaded
+        names.update({role.id: role.name for role in await get_by_ids(db, models.Role, missing)})
+    return {id: names[id] for id in ids if id in names}
 
 
 async def create_role(
@@ -289,7 +891,7 @@ async def create_role(
     new_role = models.Role(name=info.name)
     db.add(new_role)
     await db.commit()
-    await db.refresh(new_role)
+    await cache_bus.publish('refdata')
     return new_role
 
 
@@ -300,7 +902,6 @@ async def create_trait(
     new_trait = models.Trait(name=info.name)
     db.add(new_trait)
     await db.commit()
-    await db.refresh(new_trait)
     return new_trait
 
 
@@ -312,7 +913,6 @@ async def create_feedback(
     new_feedback = models.Feedback(date=info.date, content=info.content, to_user_id=info.to_user_id, from_user_id=user_id)
     db.add(new_feedback)
     await db.commit()
-    await db.refresh(new_feedback)
     return new_feedback
 
 
@@ -324,46 +924,110 @@ async def create_training_record(
     new_training_record = models.TrainingRecord(date=info.date, level=info.level, completed=info.completed, coach_id=info.coach_id, user_id=user_id)
     db.add(new_training_record)
     await db.commit()
-    await db.refresh(new_training_record)
     return new_training_record
 
 
-async def get_volunteer_records_by_user(
+def get_volunteer_record_source(
+        since: Optional[datetime.datetime] = None,
+):
+    # every record, hot and archived; a window starting after the archive horizon only needs volunteer_record
+    columns = ['id', 'date', 'hours', 'role_id', 'team_id', 'event_id', 'user_id']
+    hot = select(*[getattr(models.VolunteerRecord, column) for column in columns])
+    if since is not None and since > datetime.datetime.utcnow() - datetime.timedelta(days=ARCHIVE_HORIZON_DAYS):
+        return hot.filter(models.VolunteerRecord.date >= since).subquery()
+    archived = select(*[getattr(models.VolunteerRecordArchive, column) for column in columns])
+    if since is not None:
+        hot = hot.filter(models.VolunteerRecord.date >= since)
+        archived = archived.filter(models.VolunteerRecordArchive.date >= since)
+    return union_all(hot, archived).subquery()
+
+
+async def archive_volunteer_records(
         db: AsyncSession,
-        user_id: int,
-) -> list[models.VolunteerRecord]:
-    result = await db.execute(select(models.VolunteerRecord).filter(models.VolunteerRecord.user_id == user_id).filter(
-        models.VolunteerRecord.date < datetime.datetime.utcnow()).order_by(desc(models.VolunteerRecord.date)))
-    return result.scalars().all()
+):
+    # moves in batches so each write transaction stays short; summary tables already count these records and don't change
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=ARCHIVE_HORIZON_DAYS)
+    columns = ['id', 'date', 'hours', 'reflection', 'role_id', 'team_id', 'event_id', 'user_id']
+    while True:
+        result = await db.execute(select(models.VolunteerRecord.id).filter(models.VolunteerRecord.date < cutoff).order_by(
+            models.VolunteerRecord.date).limit(ARCHIVE_BATCH_SIZE))
+        batch = result.scalars().all()
+        if not batch:
+            break
+        await db.execute(insert(models.VolunteerRecordArchive).from_select(columns, select(
+            *[getattr(models.VolunteerRecord, column) for column in columns]).filter(models.VolunteerRecord.id.in_(batch))))
+        await db.execute(delete(models.VolunteerRecord).filter(models.VolunteerRecord.id.in_(batch)).execution_options(synchronize_session=False))
+        await db.commit()
 
 
-async def create_volunteer_record(
+async def get_volunteer_records_by_user(
+        db: AsyncSession,
+        user_id: int,
+        limit: int,
+        cursor: Optional[str] = None,
+) -> tuple[list, Optional[str]]:
+    statement = select(models.VolunteerRecord).options(
+        joinedload(models.VolunteerRecord.event), joinedload(models.VolunteerRecord.role)).filter(models.VolunteerRecord.user_id == user_id).filter(
+        models.VolunteerRecord.date < datetime.datetime.utcnow())
+    records, next_cursor = await paginate(db, statement, [models.VolunteerRecord.date, models.VolunteerRecord.id], limit, cursor, descending=True)
+    if next_cursor is not None and records[-1].date >= datetime.datetime.utcnow() - datetime.timedelta(days=ARCHIVE_HORIZON_DAYS):
+        # every archived record is older than the horizon, so none belongs on a full page that ends after it
+        return records, next_cursor
+    # a backdated record in the hot table can sort anywhere among archived ones, so the archive is paged
+    # from the same cursor and the two pages merged
+    statement = select(models.VolunteerRecordArchive).options(
+        joinedload(models.VolunteerRecordArchive.event), joinedload(models.VolunteerRecordArchive.role)).filter(
+        models.VolunteerRecordArchive.user_id == user_id)
+    archived, archive_cursor = await paginate(
+        db, statement, [models.VolunteerRecordArchive.date, models.VolunteerRecordArchive.id], limit, cursor, descending=True)
+    records = sorted([*records, *archived], key=lambda record: (record.date, record.id), reverse=True)
+    if len(records) <= limit and next_cursor is None and archive_cursor is None:
+        return records, None
+    records = records[:limit]
+    return records, encode_cursor([records[-1].date, records[-1].id])
+
+
+async def add_volunteer_record(
         db: AsyncSession,
         info: schemas.VolunteerRecordCreate,
         user_id: int,
 ) -> models.VolunteerRecord:
+    # no commit, so the write queue can put many of these in one transaction
     new_volunteer_record = models.VolunteerRecord(date=info.date, hours=info.hours, reflection=info.reflection, event_id=info.event_id,
                                                   team_id=info.team_id, role_id=info.role_id, user_id=user_id)
     db.add(new_volunteer_record)
+    await add_to_user_hours_summary(db, user_id, info.hours, info.date)
+    recent_hours = info.hours if is_past_year(info.date) else 0
+    scopes = await get_user_stat_scopes(db, user_id)
+    await add_to_stat_counters(db, scopes, {'hours': info.hours, 'hours_past_year': recent_hours, 'record_count': 1})
+    await add_to_hours_rollup(db, scopes, info.team_id, info.event_id, info.hours, info.date)
+    return new_volunteer_record
+
+
+async def create_volunteer_record(
+        db: AsyncSession,
+        info: schemas.VolunteerRecordCreate,
+        user_id: int,
+) -> models.VolunteerRecord:
+    new_volunteer_record = await add_volunteer_record(db, info, user_id)
     await db.commit()
-    await db.refresh(new_volunteer_record)
     return new_volunteer_record
 
 
 async def get_total_company_hours(
         db: AsyncSession,
+        scope: str = 'global',
+        scope_id: int = 0,
 ) -> int:
-    result = await db.execute(func.sum(models.VolunteerRecord.hours))
-    return result.scalars().first()
+    return await get_stat_counter(db, 'hours', scope, scope_id)
 
 
 async def get_total_company_hours_past_year(
         db: AsyncSession,
+        scope: str = 'global',
+        scope_id: int = 0,
 ) -> int:
-    earliest_date = datetime.datetime.utcnow() - datetime.timedelta(days=365)
-    result = await db.execute(
-        select(func.sum(models.VolunteerRecord.hours)).filter(models.VolunteerRecord.date > earliest_date))
-    return result.scalars().first()
+    return await get_stat_counter(db, 'hours_past_year', scope, scope_id)
 
 
 async def create_request(
@@ -374,7 +1038,6 @@ async def create_request(
     new_request = models.Request(date=info.date, purpose=info.purpose, content=info.content, user_id=user_id)
     db.add(new_request)
     await db.commit()
-    await db.refresh(new_request)
     return new_request
 
 
@@ -385,7 +1048,6 @@ async def create_payment(
     new_payment = models.Payment(date=info.date, amount=info.amount, purpose=info.purpose, user_id=info.user_id)
     db.add(new_payment)
     await db.commit()
-    await db.refresh(new_payment)
     return new_payment
 
 
@@ -397,7 +1059,6 @@ async def create_school_event_link(
                                              supervisor_contact=info.supervisor_contact)
     db.add(new_link)
     await db.commit()
-    await db.refresh(new_link)
     return new_link
 
 
@@ -408,7 +1069,6 @@ async def create_event_role_link(
     new_link = models.EventRoleAssociation(event_id=info.event_id, role_id=info.role_id)
     db.add(new_link)
     await db.commit()
-    await db.refresh(new_link)
     return new_link
 
 
@@ -419,7 +1079,6 @@ async def create_team_role_link(
     new_link = models.TeamRoleAssociation(team_id=info.team_id, role_id=info.role_id)
     db.add(new_link)
     await db.commit()
-    await db.refresh(new_link)
     return new_link
 
 
@@ -430,5 +1089,4 @@ async def create_team_membership(
     new_membership = models.TeamMembership(team_id=info.team_id, user_id=info.user_id, role_id=info.role_id)
     db.add(new_membership)
     await db.commit()
-    await db.refresh(new_membership)
     return new_membership
@@ -1,24 +1,106 @@
 import asyncio
-from os import path
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
 
 from fastapi import Depends
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncEngine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from website.core import crud, schemas
-from website.core.config import SQLALCHEMY_DATABASE_URL, SYNC_SQLALCHEMY_DATABASE_URL
+from website.core.config import READ_POOL_OVERFLOW, READ_POOL_SIZE, SQLALCHEMY_DATABASE_URL, SQLITE_POOL_OVERFLOW, SQLITE_POOL_SIZE, SQLITE_PRAGMAS, \
+    STARTUP_LOCK_TIMEOUT_SECONDS, SYNC_SQLALCHEMY_DATABASE_URL
+from website.core.migrations import migrate
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, future=True, echo=False)
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, future=True, echo=False, poolclass=AsyncAdaptedQueuePool,
+                             pool_size=SQLITE_POOL_SIZE, max_overflow=SQLITE_POOL_OVERFLOW)
 async_session = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+read_engine = create_async_engine(SQLALCHEMY_DATABASE_URL, future=True, echo=False, poolclass=AsyncAdaptedQueuePool,
+                                  pool_size=READ_POOL_SIZE, max_overflow=READ_POOL_OVERFLOW)
+read_session = sessionmaker(bind=read_engine, expire_on_commit=False, class_=AsyncSession, autoflush=False)
 Base = declarative_base()
 
 
-async def init_models():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.drop_all)
-        await conn.run_sync(Base.metadata.create_all)
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def set_read_only_pragmas(dbapi_connection, connection_record):
+    set_sqlite_pragmas(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only = ON")
+    cursor.close()
+
+
+event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+event.listen(read_engine.sync_engine, "connect", set_read_only_pragmas)
+
+# a one-item list per request while DEBUG is on, counting statements on both engines
+query_count: ContextVar[Optional[list]] = ContextVar('query_count', default=None)
+
+
+def count_query(*args):
+    count = query_count.get()
+    if count is not None:
+        count[0] = count[0] + 1
+
+
+event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+event.listen(read_engine.sync_engine, "before_cursor_execute", count_query)
+
+
+async def get_sqlite_settings(
+        engine: AsyncEngine,
+) -> dict:
+    settings = {}
+    async with engine.connect() as conn:
+        for name in SQLITE_PRAGMAS:
+            result = await conn.exec_driver_sql(f"PRAGMA {name}")
+            settings[name] = result.scalar()
+    return settings
+
+
+@asynccontextmanager
+async def startup_lock():
+    # BEGIN IMMEDIATE takes the write lock before anything is read, so workers starting together
+    # create, migrate and seed one after another and each sees what the one before it did
+    async with engine.connect() as conn:
+        await conn.exec_driver_sql(f"PRAGMA busy_timeout = {STARTUP_LOCK_TIMEOUT_SECONDS * 1000}")
+        try:
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+            yield conn
+            await conn.commit()
+        finally:
+            await conn.rollback()
+            await conn.exec_driver_sql(f"PRAGMA busy_timeout = {SQLITE_PRAGMAS['busy_timeout']}")
+
+
+async def init_models(
+        conn: AsyncConnection,
+):
+    await conn.run_sync(create_missing_schema)
+    await migrate(conn)
+
+
+def add_missing_columns(conn):
+    # create_all skips existing tables, so columns added to a model later are appended here
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=conn.dialect)}')
+
+
+def create_missing_schema(conn):
+    Base.metadata.create_all(conn)
+    add_missing_columns(conn)
 
 
 async def get_session() -> AsyncSession:
@@ -29,25 +111,64 @@ async def get_session() -> AsyncSession:
             await session.close()
 
 
-async def init_admin():
-    async with async_session() as db:
+ADMIN_PERMISSIONS = ["admin", "school", "program", "team", "coach", "volunteer"]
+
+
+async def grant_admin(
+        db: AsyncSession,
+        user_id: int,
+):
+    for permission in ADMIN_PERMISSIONS:
+        await crud.create_user_permission_link(db, schemas.UserPermissions(user_id=user_id, permission_name=permission))
+
+
+async def get_read_session() -> AsyncSession:
+    async with read_session() as session:
         try:
-            all_permissions = ["admin", "school", "program", "team", "coach", "volunteer"]
-            for permission in all_permissions:
-                await crud.create_permission(db, schemas.Permission(name=permission))
-                await crud.create_user_permission_link(db, schemas.UserPermissions(user_id=1, permission_name=permission))
+            yield session
         finally:
-            await db.close()
+            await session.close()
+
+
+async def seed_permissions(
+        db: AsyncSession,
+) -> list[str]:
+    created = []
+    next_bit = await crud.get_next_permission_bit(db)
+    for permission in ADMIN_PERMISSIONS:
+        if await crud.add_permission_if_missing(db, permission, next_bit):
+            created.append(permission)
+            next_bit = next_bit + 1
+    return created
+
+
+async def init_admin(
+        conn: AsyncConnection,
+):
+    # joins the startup lock's transaction, so the commits in crud don't end it
+    async with AsyncSession(bind=conn, expire_on_commit=False) as db:
+        # runs on every start, so user 1 is only made admin alongside the first seeding and later revocations stick
+        if await seed_permissions(db) == ADMIN_PERMISSIONS:
+            # with foreign keys enforced the first account can only be linked once it exists, see check_signup_user
+            if await crud.get_user(db, id=1) is not None:
+                await grant_admin(db, 1)
 
 
 async def init_database():
-    await init_models()
-    await init_admin()
+    async with startup_lock() as conn:
+        await init_models(conn)
+        await init_admin(conn)
+
+
+async def warm_connections():
+    # opens every pooled connection up front so the pragma hooks don't run on the first requests
+    async def touch(engine: AsyncEngine):
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+            await asyncio.sleep(0)  # hold the connection so the other touches have to open their own
 
+    await asyncio.gather(*[touch(engine) for _ in range(SQLITE_POOL_SIZE)], *[touch(read_engine) for _ in range(READ_POOL_SIZE)])
 
-if not path.exists("./database.db"):
-    asyncio.create_task(init_database())
-    print("Created Database!")
 
 # sync_engine = create_engine(SYNC_SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 # sync_session = sessionmaker(bind=sync_engine, expire_on_commit=False, autocommit=False, autoflush=False)
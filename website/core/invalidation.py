@@ -0,0 +1,285 @@
+import asyncio
+import datetime
+import inspect
+import json
+import traceback
+import uuid
+from typing import Awaitable, Callable, Optional, Union
+
+from sqlalchemy import delete, func, insert, select
+
+from website.core import models
+from website.core.config import CACHE_BUS_BACKEND, CACHE_BUS_MAX_LAG_SECONDS, CACHE_BUS_POLL_SECONDS, CACHE_BUS_REDIS_URL, \
+    CACHE_EVENT_RETENTION_SECONDS
+
+# handler(key) drops what key names in this worker's caches; key None means drop everything the channel covers,
+# which is sent when a worker may have missed events
+Handler = Callable[[Optional[str]], Union[None, Awaitable]]
+# (id, channel, key, origin) in id order; channel None marks missed events
+Event = tuple[int, Optional[str], Optional[str], Optional[str]]
+
+READ_LIMIT = 1000
+
+
+class SQLiteBackend:
+    def __init__(
+            self,
+            session_factory,
+            read_session_factory,
+            retention: float,
+    ):
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.retention = retention
+
+    async def latest(self) -> int:
+        async with self.read_session_factory() as db:
+            result = await db.execute(select(func.max(models.CacheEvent.id)))
+            return result.scalar() or 0
+
+    async def publish(
+            self,
+            channel: str,
+            key: Optional[str],
+            origin: str,
+    ):
+        async with self.session_factory() as db:
+            await db.execute(insert(models.CacheEvent).values(channel=channel, key=key, origin=origin, created=datetime.datetime.utcnow()))
+            await db.commit()
+
+    async def read(
+            self,
+            after: int,
+    ) -> list[Event]:
+        async with self.read_session_factory() as db:
+            result = await db.execute(select(models.CacheEvent.id, models.CacheEvent.channel, models.CacheEvent.key, models.CacheEvent.origin)
+                                      .filter(models.CacheEvent.id > after).order_by(models.CacheEvent.id).limit(READ_LIMIT))
+            events = [tuple(row) for row in result.all()]
+            if events and events[0][0] > after + 1:
+                # ids are handed out in commit order, so a hole before the first row means rows were pruned unread
+                oldest = (await db.execute(select(func.min(models.CacheEvent.id)))).scalar()
+                if oldest > after + 1:
+                    events.insert(0, (oldest - 1, None, None, None))
+            return events
+
+    async def prune(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.retention)
+        async with self.session_factory() as db:
+            # the newest event always stays, so a worker further behind than the retention still sees the hole
+            newest = select(func.max(models.CacheEvent.id)).scalar_subquery()
+            await db.execute(delete(models.CacheEvent).where(models.CacheEvent.created < cutoff, models.CacheEvent.id < newest)
+                             .execution_options(synchronize_session=False))
+            await db.commit()
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    # only INCR, SET with EX, GET and MGET, so any Redis-compatible server will do
+    def __init__(
+            self,
+            url: str,
+            retention: float,
+            prefix: str = 'cache_bus:',
+            grace: float = 5.0,
+    ):
+        import redis.asyncio  # optional dependency from requirements-redis.txt, only needed when CACHE_BUS_BACKEND = 'redis'
+        self.redis = redis.asyncio.from_url(url, decode_responses=True)
+        self.retention = retention
+        self.prefix = prefix
+        self.grace = grace  # how long a publisher may take between its INCR and its SET
+        self._epochs: list[tuple[float, int]] = []  # (when, epoch) as seen by earlier reads, oldest first
+
+    async def latest(self) -> int:
+        return int(await self.redis.get(f"{self.prefix}epoch") or 0)
+
+    async def publish(
+            self,
+            channel: str,
+            key: Optional[str],
+            origin: str,
+    ):
+        id = await self.redis.incr(f"{self.prefix}epoch")
+        await self.redis.set(f"{self.prefix}event:{id}", json.dumps([channel, key, origin]), ex=int(self.retention))
+
+    async def read(
+            self,
+            after: int,
+    ) -> list[Event]:
+        epoch = await self.latest()
+        if epoch <= after:
+            return []
+        # an id counted longer than the grace period ago whose event is missing expired or lost its publisher;
+        # a younger one may still be on its way, so reading stops there until the next poll
+        now = asyncio.get_running_loop().time()
+        self._epochs.append((now, epoch))
+        settled = [i for i, (seen, _) in enumerate(self._epochs) if seen <= now - self.grace]
+        if settled:
+            self._epochs = self._epochs[settled[-1]:]
+        written = self._epochs[0][1] if settled else after
+        events = []
+        start = after + 1
+        while start <= epoch:
+            ids = range(start, min(epoch, start + READ_LIMIT - 1) + 1)
+            for id, value in zip(ids, await self.redis.mget([f"{self.prefix}event:{id}" for id in ids])):
+                if value is not None:
+                    channel, key, origin = json.loads(value)
+                    events.append((id, channel, key, origin))
+                elif id > written:
+                    return events
+                elif events and events[-1][1] is None:
+                    events[-1] = (id, None, None, None)  # a run of missing ids is one hole
+                else:
+                    events.append((id, None, None, None))
+            if len(events) != 1 or events[0][1] is not None:
+                break
+            start = ids[-1] + 1  # everything so far expired, so skip ahead rather than flushing once per batch
+        return events
+
+    async def prune(self):
+        pass  # events expire on their own
+
+    async def close(self):
+        if hasattr(self.redis, 'aclose'):  # redis 5 renamed close, which now warns
+            await self.redis.aclose()
+        else:
+            await self.redis.close()
+
+
+class CacheBus:
+    def __init__(
+            self,
+            poll_interval: float,
+            max_lag: float,
+    ):
+        self.poll_interval = poll_interval
+        self.max_lag = max_lag
+        self.origin = uuid.uuid4().hex
+        self.epoch = 0  # id of the last event this worker has applied
+        self.published = 0
+        self.received = 0
+        self.flushes = 0
+        self.errors = 0
+        self.backend = None
+        self._handlers: dict[str, list[Handler]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_poll: Optional[float] = None
+
+    def subscribe(
+            self,
+            channel: str,
+            handler: Handler,
+    ):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def start(
+            self,
+            backend,
+    ):
+        self.backend = backend
+        self.epoch = await backend.latest()  # caches are loaded after this, so nothing earlier applies to them
+        self._last_poll = asyncio.get_running_loop().time()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        await self.backend.close()
+        self._task = None
+        self.backend = None
+
+    async def publish(
+            self,
+            channel: str,
+            key: Optional[str] = None,
+    ):
+        # call after the write commits; this worker applies it at once, the others on their next poll
+        await self._apply(channel, key)
+        if self.backend is None:  # not started (scripts, maintenance), so there is nobody else to tell
+            return
+        self.published = self.published + 1
+        try:
+            await self.backend.publish(channel, key, self.origin)
+        except Exception:
+            # the write itself committed, so the caller isn't failed; other workers catch up through cache TTLs
+            self.errors = self.errors + 1
+            traceback.print_exc()
+
+    async def poll(self):
+        events = await self.backend.read(self.epoch)
+        if any(channel is None for _, channel, _, _ in events):
+            # flushed caches reload from the database, which already has every write in the batch
+            await self.flush()
+            self.epoch = events[-1][0]
+            return
+        for id, channel, key, origin in events:
+            if origin != self.origin:
+                self.received = self.received + 1
+                await self._apply(channel, key)
+            self.epoch = id
+
+    async def flush(self):
+        self.flushes = self.flushes + 1
+        for channel in self._handlers:
+            await self._apply(channel, None)
+
+    async def _apply(
+            self,
+            channel: str,
+            key: Optional[str],
+    ):
+        for handler in self._handlers.get(channel, []):
+            try:
+                result = handler(key)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                self.errors = self.errors + 1
+                traceback.print_exc()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_prune = loop.time()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+                self._last_poll = loop.time()
+                if loop.time() - last_prune > self.backend.retention / 10:
+                    last_prune = loop.time()
+                    await self.backend.prune()
+            except Exception:
+                self.errors = self.errors + 1
+                traceback.print_exc()
+                if loop.time() - self._last_poll > self.max_lag:
+                    # writes from other workers can't be heard about, so nothing cached may live longer than a poll
+                    await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "epoch": self.epoch,
+            "published": self.published,
+            "received": self.received,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
+
+
+def create_backend(
+        session_factory,
+        read_session_factory,
+):
+    if CACHE_BUS_BACKEND == 'redis':
+        return RedisBackend(CACHE_BUS_REDIS_URL, CACHE_EVENT_RETENTION_SECONDS)
+    return SQLiteBackend(session_factory, read_session_factory, CACHE_EVENT_RETENTION_SECONDS)
+
+
+cache_bus = CacheBus(CACHE_BUS_POLL_SECONDS, CACHE_BUS_MAX_LAG_SECONDS)
@@ -0,0 +1,42 @@
+import asyncio
+import traceback
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from website.core import crud
+from website.core.config import ARCHIVE_INTERVAL_SECONDS, HOURS_SUMMARY_REBUILD_SECONDS, LEADERBOARD_REBUILD_SECONDS, STAT_COUNTER_RECONCILE_SECONDS
+from website.core.database import async_session
+
+# (job, interval in seconds); every job is idempotent, so running one in several workers is only wasted work
+PERIODIC_JOBS: list[tuple[Callable[[AsyncSession], Awaitable], float]] = [
+    (crud.rebuild_user_hours_summary, HOURS_SUMMARY_REBUILD_SECONDS),
+    (crud.rebuild_leaderboard_snapshot, LEADERBOARD_REBUILD_SECONDS),
+    (crud.archive_volunteer_records, ARCHIVE_INTERVAL_SECONDS),
+    (crud.reconcile_stat_counters, STAT_COUNTER_RECONCILE_SECONDS),  # also ages hours out of hours_past_year
+]
+
+
+async def run_periodically(
+        job: Callable[[AsyncSession], Awaitable],
+        interval: float,
+):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with async_session() as db:
+                await job(db)
+        except Exception:
+            traceback.print_exc()
+
+
+def start_periodic_jobs() -> list[asyncio.Task]:
+    return [asyncio.create_task(run_periodically(job, interval)) for job, interval in PERIODIC_JOBS]
+
+
+async def stop_periodic_jobs(
+        tasks: list[asyncio.Task],
+):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
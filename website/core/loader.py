@@ -0,0 +1,94 @@
+import asyncio
+from typing import Optional
+
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from website.core import crud, models
+from website.core.database import get_read_session
+
+
+class Loader:
+    def __init__(
+            self,
+            db: AsyncSession,
+            lock: asyncio.Lock,
+            model,
+            options: tuple,
+    ):
+        self.db = db
+        self.lock = lock
+        self.model = model
+        self.options = options
+        self._loaded: dict = {}  # id -> row, or None when the id doesn't exist
+        self._pending: dict[int, asyncio.Future] = {}
+        self._dispatch_task: Optional[asyncio.Task] = None
+
+    async def load(
+            self,
+            id: Optional[int],
+    ):
+        if id is None:
+            return None
+        if id in self._loaded:
+            return self._loaded[id]
+        future = self._pending.get(id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[id] = future
+            if len(self._pending) == 1:
+                # runs after every lookup already scheduled in this loop iteration has queued its id
+                self._dispatch_task = asyncio.create_task(self._dispatch())
+        return await future
+
+    async def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        try:
+            async with self.lock:  # loaders share the request's session, which runs one query at a time
+                rows = await crud.get_by_ids(self.db, self.model, list(pending), self.options)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {row.id: row for row in rows}
+        for id, future in pending.items():
+            self._loaded[id] = found.get(id)
+            if not future.done():
+                future.set_result(found.get(id))
+
+
+class RequestLoader:
+    # users only: roles, schools and regions come from the reference data cache, and validators check
+    # references with one EXISTS query rather than loading rows
+    def __init__(
+            self,
+            db: AsyncSession,
+    ):
+        self.db = db
+        self._lock = asyncio.Lock()
+        self._loaders: dict[tuple, Loader] = {}
+
+    def _loader(
+            self,
+            model,
+            profile: Optional[str] = None,
+    ) -> Loader:
+        key = (model, profile)
+        if key not in self._loaders:
+            self._loaders[key] = Loader(self.db, self._lock, model, crud.load_profile(profile))
+        return self._loaders[key]
+
+    async def get_user(
+            self,
+            id: Optional[int],
+            profile: Optional[str] = None,
+    ) -> Optional[models.User]:
+        return await self._loader(models.User, profile).load(id)
+
+
+async def get_loader(
+        db: AsyncSession = Depends(get_read_session),
+) -> RequestLoader:
+    # FastAPI builds each dependency once per request, so every dependant of the request shares this loader
+    return RequestLoader(db)
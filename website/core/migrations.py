@@ -0,0 +1,99 @@
+from typing import Callable, Union
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+def rebuild_volunteer_record(conn):
+    # without AUTOINCREMENT SQLite hands out max(id) + 1, so archiving the newest record frees its id for the next insert
+    table = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'volunteer_record'").scalar()
+    if 'AUTOINCREMENT' in table.upper():  # created by create_all from the current model
+        return
+    conn.exec_driver_sql('ALTER TABLE volunteer_record RENAME TO volunteer_record_old')
+    conn.exec_driver_sql(
+        'CREATE TABLE volunteer_record (id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT, date DATETIME, hours INTEGER, reflection VARCHAR, '
+        'role_id INTEGER, team_id INTEGER, event_id INTEGER, user_id INTEGER, UNIQUE (id), '
+        'FOREIGN KEY(role_id) REFERENCES role (id), FOREIGN KEY(team_id) REFERENCES team (id), '
+        'FOREIGN KEY(event_id) REFERENCES event (id), FOREIGN KEY(user_id) REFERENCES user (id))')
+    conn.exec_driver_sql('INSERT INTO volunteer_record (id, date, hours, reflection, role_id, team_id, event_id, user_id) '
+                         'SELECT id, date, hours, reflection, role_id, team_id, event_id, user_id FROM volunteer_record_old')
+    conn.exec_driver_sql('DROP TABLE volunteer_record_old')  # takes the old indexes with it, so their names are free again
+    conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_user_id_date ON volunteer_record (user_id, date)')
+    conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_date ON volunteer_record (date)')
+    conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_role_id ON volunteer_record (role_id)')
+    conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_team_id ON volunteer_record (team_id)')
+    conn.exec_driver_sql('CREATE INDEX ix_volunteer_record_event_id ON volunteer_record (event_id)')
+
+
+# (version, description, steps), applied in order to databases whose PRAGMA user_version is lower.
+# A step is raw SQL or a function taking the sync connection. New databases run every step on top
+# of create_all, so steps must be safe to run against a schema that already has them.
+MIGRATIONS: list[tuple[int, str, list[Union[str, Callable]]]] = [
+    (1, "foreign key, date and permission bit indexes", [
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_permission_bit ON permission (bit)',
+        'CREATE INDEX IF NOT EXISTS ix_user_school_id ON user (school_id)',
+        'CREATE INDEX IF NOT EXISTS ix_program_region_id ON program (region_id)',
+        'CREATE INDEX IF NOT EXISTS ix_school_region_id ON school (region_id)',
+        'CREATE INDEX IF NOT EXISTS ix_event_date ON event (date)',
+        'CREATE INDEX IF NOT EXISTS ix_team_program_id ON team (program_id)',
+        'CREATE INDEX IF NOT EXISTS ix_feedback_to_user_id ON feedback (to_user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_feedback_from_user_id ON feedback (from_user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_training_record_coach_id ON training_record (coach_id)',
+        'CREATE INDEX IF NOT EXISTS ix_training_record_user_id ON training_record (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_volunteer_record_user_id_date ON volunteer_record (user_id, date)',
+        'CREATE INDEX IF NOT EXISTS ix_volunteer_record_date ON volunteer_record (date)',
+        'CREATE INDEX IF NOT EXISTS ix_volunteer_record_role_id ON volunteer_record (role_id)',
+        'CREATE INDEX IF NOT EXISTS ix_volunteer_record_team_id ON volunteer_record (team_id)',
+        'CREATE INDEX IF NOT EXISTS ix_volunteer_record_event_id ON volunteer_record (event_id)',
+        'CREATE INDEX IF NOT EXISTS ix_request_user_id ON request (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_payment_user_id ON payment (user_id)',
+        'CREATE INDEX IF NOT EXISTS ix_team_membership_team_id ON team_membership (team_id)',
+        'CREATE INDEX IF NOT EXISTS ix_user_trait_association_trait_id ON user_trait_association (trait_id)',
+        'CREATE INDEX IF NOT EXISTS ix_school_event_association_event_id ON school_event_association (event_id)',
+        'CREATE INDEX IF NOT EXISTS ix_event_role_association_role_id ON event_role_association (role_id)',
+        'CREATE INDEX IF NOT EXISTS ix_team_role_association_role_id ON team_role_association (role_id)',
+        'ANALYZE',
+    ]),
+    (2, "backfill user_hours_summary", [
+        "INSERT OR REPLACE INTO user_hours_summary (user_id, total_hours, recent_hours, record_count) "
+        "SELECT user_id, SUM(hours), SUM(CASE WHEN date > datetime('now', '-365 days') THEN hours ELSE 0 END), COUNT(id) "
+        "FROM volunteer_record WHERE user_id IS NOT NULL GROUP BY user_id",
+    ]),
+    (3, "volunteer_record ids are never reused", [
+        rebuild_volunteer_record,
+        # past every id ever handed out, including ones that only live in the archive now
+        "DELETE FROM sqlite_sequence WHERE name = 'volunteer_record'",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'volunteer_record', "
+        "max(coalesce((SELECT max(id) FROM volunteer_record), 0), coalesce((SELECT max(id) FROM volunteer_record_archive), 0))",
+        # records that were already given the id of an archived one get a new id, so the next archive run can move them
+        "INSERT INTO volunteer_record (date, hours, reflection, role_id, team_id, event_id, user_id) "
+        "SELECT date, hours, reflection, role_id, team_id, event_id, user_id FROM volunteer_record "
+        "WHERE id IN (SELECT id FROM volunteer_record_archive) ORDER BY id",
+        "DELETE FROM volunteer_record WHERE id IN (SELECT id FROM volunteer_record_archive)",
+    ]),
+]
+
+
+async def get_schema_version(
+        conn: AsyncConnection,
+) -> int:
+    result = await conn.exec_driver_sql("PRAGMA user_version")
+    return result.scalar()
+
+
+async def migrate(
+        conn: AsyncConnection,
+) -> int:
+    # runs inside the caller's write transaction, so no other worker can apply the version read here first
+    version = await get_schema_version(conn)
+    for target, description, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        for step in steps:
+            if callable(step):
+                await conn.run_sync(step)
+            else:
+                await conn.exec_driver_sql(step)
+        await conn.exec_driver_sql(f"PRAGMA user_version = {target}")
+        print(f"Migrated database to version {target}: {description}")
+        version = target
+    return version
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Date, Integer, String, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Date, Index, Integer, String, DateTime
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -33,18 +33,19 @@ class User(Base):
     volunteer_status = Column(String)
     volunteer_goals = Column(String)
     #
-    school_id = Column(Integer, ForeignKey("school.id"))
-    school = relationship("School", uselist=False, back_populates="students", lazy='selectin')
-    teams = relationship("TeamMembership", lazy='selectin')
-    traits = relationship("UserTraitAssociation", lazy='selectin')
-    feedback_received = relationship("Feedback", back_populates="recipient", foreign_keys="[Feedback.to_user_id]", lazy='selectin')
-    feedback_given = relationship("Feedback", back_populates="author", foreign_keys="[Feedback.from_user_id]", lazy='selectin')
-    training_records = relationship("TrainingRecord", back_populates="user", foreign_keys="[TrainingRecord.user_id]", lazy='selectin')
-    volunteer_records = relationship("VolunteerRecord", back_populates="user", lazy='selectin')
-    requests = relationship("Request", back_populates="user", lazy='selectin')
-    payments = relationship("Payment", back_populates="user", lazy='selectin')
+    school_id = Column(Integer, ForeignKey("school.id"), index=True)
+    school = relationship("School", uselist=False, back_populates="students", lazy='raise')
+    teams = relationship("TeamMembership", lazy='raise')
+    traits = relationship("UserTraitAssociation", lazy='raise')
+    feedback_received = relationship("Feedback", back_populates="recipient", foreign_keys="[Feedback.to_user_id]", lazy='raise')
+    feedback_given = relationship("Feedback", back_populates="author", foreign_keys="[Feedback.from_user_id]", lazy='raise')
+    training_records = relationship("TrainingRecord", back_populates="user", foreign_keys="[TrainingRecord.user_id]", lazy='raise')
+    volunteer_records = relationship("VolunteerRecord", back_populates="user", lazy='raise')
+    requests = relationship("Request", back_populates="user", lazy='raise')
+    payments = relationship("Payment", back_populates="user", lazy='raise')
     #
-    permissions = relationship("UserPermissions", lazy='selectin')
+    permissions = relationship("UserPermissions", lazy='raise')
+    refresh_tokens = relationship("RefreshToken", back_populates="user", lazy='raise')
 
 
 class UserPermissions(Base):
@@ -54,10 +55,31 @@ class UserPermissions(Base):
     permission_name = Column(ForeignKey("permission.name"), primary_key=True)
 
 
+class RefreshToken(Base):
+    __tablename__ = "refresh_token"
+
+    id = Column(Integer, primary_key=True, unique=True)
+    token_hash = Column(String, unique=True, index=True)
+    created = Column(DateTime)
+    expires = Column(DateTime)
+    revoked = Column(Boolean, default=False)
+    #
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    user = relationship("User", uselist=False, back_populates="refresh_tokens", lazy='raise')
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_token"
+
+    jti = Column(String, primary_key=True)
+    expires = Column(DateTime, index=True)
+
+
 class Permission(Base):
     __tablename__ = "permission"
 
     name = Column(String, primary_key=True)
+    bit = Column(Integer, unique=True, index=True)  # position of this permission in token scope masks, never reused
 
 
 class Region(Base):
@@ -68,8 +90,8 @@ class Region(Base):
     name = Column(String, unique=True)
     abbreviation = Column(String)
     #
-    schools = relationship("School", back_populates="region", lazy='selectin')
-    programs = relationship("Program", back_populates="region", lazy='selectin')
+    schools = relationship("School", back_populates="region", lazy='raise')
+    programs = relationship("Program", back_populates="region", lazy='raise')
 
 
 class Program(Base):
@@ -78,9 +100,9 @@ class Program(Base):
     id = Column(Integer, primary_key=True, unique=True)
     name = Column(String, unique=True)
     #
-    region_id = Column(Integer, ForeignKey("region.id"))
-    region = relationship("Region", uselist=False, back_populates="programs", lazy='selectin')
-    teams = relationship("Team", back_populates="program", lazy='selectin')
+    region_id = Column(Integer, ForeignKey("region.id"), index=True)
+    region = relationship("Region", uselist=False, back_populates="programs", lazy='raise')
+    teams = relationship("Team", back_populates="program", lazy='raise')
 
 
 class School(Base):
@@ -90,10 +112,10 @@ class School(Base):
     abbreviation = Column(String, unique=True)
     name = Column(String, unique=True)
     #
-    region_id = Column(Integer, ForeignKey("region.id"))
-    region = relationship("Region", uselist=False, back_populates="schools", lazy='selectin')
-    students = relationship("User", back_populates="school", lazy='selectin')
-    events = relationship("SchoolEventAssociation", lazy='selectin')
+    region_id = Column(Integer, ForeignKey("region.id"), index=True)
+    region = relationship("Region", uselist=False, back_populates="schools", lazy='raise')
+    students = relationship("User", back_populates="school", lazy='raise')
+    events = relationship("SchoolEventAssociation", lazy='raise')
 
 
 class Event(Base):
@@ -101,11 +123,11 @@ class Event(Base):
 
     id = Column(Integer, primary_key=True, unique=True)
     name = Column(String)
-    date = Column(Date)
+    date = Column(Date, index=True)
     #
-    schools = relationship("SchoolEventAssociation", lazy='selectin')
-    roles = relationship("EventRoleAssociation", lazy='selectin')
-    volunteer_records = relationship("VolunteerRecord", lazy='selectin')
+    schools = relationship("SchoolEventAssociation", lazy='raise')
+    roles = relationship("EventRoleAssociation", lazy='raise')
+    volunteer_records = relationship("VolunteerRecord", lazy='raise')
 
 
 class Team(Base):
@@ -114,11 +136,11 @@ class Team(Base):
     id = Column(Integer, primary_key=True, unique=True)
     name = Column(String)
     #
-    volunteer_records = relationship("VolunteerRecord", lazy='selectin')
-    program_id = Column(Integer, ForeignKey("program.id"))
-    program = relationship("Program", uselist=False, back_populates="teams", lazy='selectin')
-    members = relationship("TeamMembership", lazy='selectin')
-    roles = relationship("TeamRoleAssociation", lazy='selectin')
+    volunteer_records = relationship("VolunteerRecord", lazy='raise')
+    program_id = Column(Integer, ForeignKey("program.id"), index=True)
+    program = relationship("Program", uselist=False, back_populates="teams", lazy='raise')
+    members = relationship("TeamMembership", lazy='raise')
+    roles = relationship("TeamRoleAssociation", lazy='raise')
 
 
 class Role(Base):
@@ -127,8 +149,8 @@ class Role(Base):
     id = Column(Integer, primary_key=True, unique=True)
     name = Column(String)
     #
-    events = relationship("EventRoleAssociation", lazy='selectin')
-    teams = relationship("TeamRoleAssociation", lazy='selectin')
+    events = relationship("EventRoleAssociation", lazy='raise')
+    teams = relationship("TeamRoleAssociation", lazy='raise')
 
 
 class Trait(Base):
@@ -145,10 +167,10 @@ class Feedback(Base):
     date = Column(DateTime)
     content = Column(String)
     #
-    to_user_id = Column(Integer, ForeignKey("user.id"))
-    recipient = relationship("User", uselist=False, back_populates="feedback_received", foreign_keys="[Feedback.to_user_id]", lazy='selectin')
-    from_user_id = Column(Integer, ForeignKey("user.id"))
-    author = relationship("User", uselist=False, back_populates="feedback_given", foreign_keys="[Feedback.from_user_id]", lazy='selectin')
+    to_user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    recipient = relationship("User", uselist=False, back_populates="feedback_received", foreign_keys="[Feedback.to_user_id]", lazy='raise')
+    from_user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    author = relationship("User", uselist=False, back_populates="feedback_given", foreign_keys="[Feedback.from_user_id]", lazy='raise')
 
 
 class TrainingRecord(Base):
@@ -159,28 +181,111 @@ class TrainingRecord(Base):
     level = Column(String)
     completed = Column(Boolean)
     #
-    coach_id = Column(Integer, ForeignKey("user.id"))
-    coach = relationship("User", uselist=False, foreign_keys="[TrainingRecord.coach_id]", lazy='selectin')
-    user_id = Column(Integer, ForeignKey("user.id"))
-    user = relationship("User", uselist=False, back_populates="training_records", foreign_keys="[TrainingRecord.user_id]", lazy='selectin')
+    coach_id = Column(Integer, ForeignKey("user.id"), index=True)
+    coach = relationship("User", uselist=False, foreign_keys="[TrainingRecord.coach_id]", lazy='raise')
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    user = relationship("User", uselist=False, back_populates="training_records", foreign_keys="[TrainingRecord.user_id]", lazy='raise')
 
 
 class VolunteerRecord(Base):
     __tablename__ = "volunteer_record"
+    __table_args__ = (
+        Index("ix_volunteer_record_user_id_date", "user_id", "date"),
+        {'sqlite_autoincrement': True},  # archived ids must never be handed out again, see migration 3
+    )
 
     id = Column(Integer, primary_key=True, unique=True)
+    date = Column(DateTime, index=True)
+    hours = Column(Integer)
+    reflection = Column(String)
+    #
+    role_id = Column(Integer, ForeignKey("role.id"), index=True)
+    role = relationship("Role", uselist=False, lazy='raise')
+    team_id = Column(Integer, ForeignKey("team.id"), index=True)
+    team = relationship("Team", uselist=False, back_populates="volunteer_records", lazy='raise')
+    event_id = Column(Integer, ForeignKey("event.id"), index=True)
+    event = relationship("Event", uselist=False, back_populates="volunteer_records", lazy='raise')
+    user_id = Column(Integer, ForeignKey("user.id"))
+    user = relationship("User", uselist=False, back_populates="volunteer_records", lazy='raise')
+
+
+class VolunteerRecordArchive(Base):
+    __tablename__ = "volunteer_record_archive"
+    __table_args__ = (
+        Index("ix_volunteer_record_archive_user_id_date", "user_id", "date"),
+    )
+
+    id = Column(Integer, primary_key=True)  # the id the record had in volunteer_record
     date = Column(DateTime)
     hours = Column(Integer)
     reflection = Column(String)
     #
     role_id = Column(Integer, ForeignKey("role.id"))
-    role = relationship("Role", uselist=False, lazy='selectin')
+    role = relationship("Role", uselist=False, lazy='raise')
     team_id = Column(Integer, ForeignKey("team.id"))
-    team = relationship("Team", uselist=False, back_populates="volunteer_records", lazy='selectin')
+    team = relationship("Team", uselist=False, lazy='raise')
     event_id = Column(Integer, ForeignKey("event.id"))
-    event = relationship("Event", uselist=False, back_populates="volunteer_records", lazy='selectin')
+    event = relationship("Event", uselist=False, lazy='raise')
     user_id = Column(Integer, ForeignKey("user.id"))
-    user = relationship("User", uselist=False, back_populates="volunteer_records", lazy='selectin')
+
+
+class UserHoursSummary(Base):
+    __tablename__ = "user_hours_summary"
+
+    user_id = Column(ForeignKey("user.id"), primary_key=True)
+    total_hours = Column(Integer, default=0)
+    recent_hours = Column(Integer, default=0)  # last 365 days, recomputed by rebuild_user_hours_summary
+    record_count = Column(Integer, default=0)
+
+
+class LeaderboardEntry(Base):
+    __tablename__ = "leaderboard_snapshot"
+    __table_args__ = (
+        Index("ix_leaderboard_snapshot_rank_user_id", "rank", "user_id"),
+    )
+
+    user_id = Column(ForeignKey("user.id"), primary_key=True)
+    rank = Column(Integer)  # position by total hours, ties share a rank
+    hours = Column(Integer)
+    name = Column(String)
+    school = Column(String)
+    region = Column(String)
+    country = Column(String)
+    training_level = Column(String)
+    user_rank = Column(String)
+    start_date = Column(Date)
+    built = Column(DateTime)
+
+
+class StatCounter(Base):
+    __tablename__ = "stat_counter"
+
+    scope = Column(String, primary_key=True)  # 'global', 'school' or 'region'
+    scope_id = Column(Integer, primary_key=True)  # 0 for global
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0)  # kept by crud.create_*, drift fixed by reconcile_stat_counters
+
+
+class HoursRollup(Base):
+    __tablename__ = "hours_rollup"
+
+    granularity = Column(String, primary_key=True)  # 'day' or 'week', weeks start on Monday
+    dimension = Column(String, primary_key=True)  # 'global', 'school', 'region', 'program', 'team' or 'event'
+    dimension_id = Column(Integer, primary_key=True)  # 0 for global
+    bucket_start = Column(Date, primary_key=True)
+    hours = Column(Integer, default=0)
+    record_count = Column(Integer, default=0)
+
+
+class CacheEvent(Base):
+    __tablename__ = "cache_event"
+    __table_args__ = {'sqlite_autoincrement': True}  # ids are the epoch workers poll past, so they are never reused
+
+    id = Column(Integer, primary_key=True)
+    channel = Column(String)
+    key = Column(String)
+    origin = Column(String)  # the worker that published it, which applied it before sending
+    created = Column(DateTime, index=True)
 
 
 class Request(Base):
@@ -191,8 +296,8 @@ class Request(Base):
     purpose = Column(String)
     content = Column(String)
     #
-    user_id = Column(Integer, ForeignKey("user.id"))
-    user = relationship("User", uselist=False, back_populates="requests", lazy='selectin')
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    user = relationship("User", uselist=False, back_populates="requests", lazy='raise')
 
 
 class Payment(Base):
@@ -203,15 +308,15 @@ class Payment(Base):
     amount = Column(Integer)
     purpose = Column(String)
     #
-    user_id = Column(Integer, ForeignKey("user.id"))
-    user = relationship("User", uselist=False, back_populates="payments", lazy='selectin')
+    user_id = Column(Integer, ForeignKey("user.id"), index=True)
+    user = relationship("User", uselist=False, back_populates="payments", lazy='raise')
 
 
 class TeamMembership(Base):
     __tablename__ = "team_membership"
 
     user_id = Column(ForeignKey("user.id"), primary_key=True)
-    team_id = Column(ForeignKey("team.id"), primary_key=True)
+    team_id = Column(ForeignKey("team.id"), primary_key=True, index=True)
     role_id = Column(ForeignKey("role.id"), primary_key=True)
 
 
@@ -219,7 +324,7 @@ class UserTraitAssociation(Base):
     __tablename__ = "user_trait_association"
 
     user_id = Column(ForeignKey("user.id"), primary_key=True)
-    trait_id = Column(ForeignKey("trait.id"), primary_key=True)
+    trait_id = Column(ForeignKey("trait.id"), primary_key=True, index=True)
     count = Column(Integer)
 
 
@@ -227,7 +332,7 @@ class SchoolEventAssociation(Base):
     __tablename__ = "school_event_association"
 
     school_id = Column(ForeignKey("school.id"), primary_key=True)
-    event_id = Column(ForeignKey("event.id"), primary_key=True)
+    event_id = Column(ForeignKey("event.id"), primary_key=True, index=True)
     supervisor = Column(String)
     supervisor_contact = Column(String)
 
@@ -236,11 +341,11 @@ class EventRoleAssociation(Base):
     __tablename__ = "event_role_association"
 
     event_id = Column(ForeignKey("event.id"), primary_key=True)
-    role_id = Column(ForeignKey("role.id"), primary_key=True)
+    role_id = Column(ForeignKey("role.id"), primary_key=True, index=True)
 
 
 class TeamRoleAssociation(Base):
     __tablename__ = "team_role_association"
 
     team_id = Column(ForeignKey("team.id"), primary_key=True)
-    role_id = Column(ForeignKey("role.id"), primary_key=True)
+    role_id = Column(ForeignKey("role.id"), primary_key=True, index=True)
@@ -0,0 +1,94 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.hash import bcrypt
+
+from website.core.config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return bcrypt.verify(password, hashed)
+
+
+class PasswordHasher:
+    def __init__(
+            self,
+            workers: int,
+            queue_size: int,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0  # raised in the worker or lost with it, e.g. BrokenProcessPool
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def hash(
+            self,
+            password: str,
+    ) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(
+            self,
+            password: str,
+            hashed: str,
+    ) -> bool:
+        return await self._run(_verify, password, hashed)
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.queue_size:
+            self.rejected = self.rejected + 1
+            raise HashQueueFull()
+        if self._executor is None:
+            # spawn, not fork: the parent runs event loop and sqlite threads
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self.pending = self.pending + 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except Exception:  # a cancelled caller isn't a failed hash
+            self.failed = self.failed + 1
+            raise
+        finally:
+            self.pending = self.pending - 1
+        elapsed = time.perf_counter() - started
+        self.completed = self.completed + 1
+        self.total_seconds = self.total_seconds + elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(self.pending - self.workers, 0),
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0,
+            "max_latency_ms": round(self.max_seconds * 1000, 2),
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
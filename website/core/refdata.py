@@ -0,0 +1,100 @@
+import asyncio
+from typing import Any, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from website.core import models
+
+
+class ReferenceSnapshot:
+    # immutable once built; rows are plain Row tuples so they aren't tied to the session that loaded them
+    def __init__(
+            self,
+            version: int,
+            regions: list,
+            schools: list,
+            programs: list,
+            roles: list,
+            permissions: list,
+    ):
+        self.version = version
+        self.regions = {row.id: row for row in regions}
+        self.regions_by_name = {row.name: row for row in regions}
+        self.regions_by_abbreviation = {row.abbreviation: row for row in regions}
+        self.schools = {row.id: row for row in schools}
+        self.schools_by_name = {row.name: row for row in schools}
+        self.schools_by_abbreviation = {row.abbreviation: row for row in schools}
+        self.programs = {row.id: row for row in programs}
+        self.programs_by_name = {row.name: row for row in programs}
+        self.roles = {row.id: row for row in roles}
+        self.permissions = {row.name: row for row in permissions}
+        # (model, column name) -> index, for crud.check_references
+        self.indexes = {
+            (models.Region, 'id'): self.regions,
+            (models.Region, 'name'): self.regions_by_name,
+            (models.Region, 'abbreviation'): self.regions_by_abbreviation,
+            (models.School, 'id'): self.schools,
+            (models.School, 'name'): self.schools_by_name,
+            (models.School, 'abbreviation'): self.schools_by_abbreviation,
+            (models.Program, 'id'): self.programs,
+            (models.Program, 'name'): self.programs_by_name,
+            (models.Role, 'id'): self.roles,
+            (models.Permission, 'name'): self.permissions,
+        }
+
+    def lookup(
+            self,
+            column,
+            value: Any,
+    ) -> Optional[Any]:
+        index = self.indexes.get((column.class_, column.key))
+        return None if index is None else index.get(value)
+
+
+class ReferenceDataCache:
+    # These tables are insert-only, so a cached row is never wrong, only possibly missing. Callers treat
+    # a miss as "ask the database", which keeps rows created by another worker visible.
+    def __init__(self):
+        self.version = 0  # bumped by every invalidate, a snapshot built from an older version is reloaded
+        self.loads = 0
+        self.snapshot: Optional[ReferenceSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version = self.version + 1
+
+    async def get(
+            self,
+            db: AsyncSession,
+    ) -> ReferenceSnapshot:
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        async with self._lock:  # one reload at a time, requests waiting on it use its result
+            if self.snapshot is not None and self.snapshot.version == self.version:
+                return self.snapshot
+            version = self.version
+            tables = []
+            for model in (models.Region, models.School, models.Program, models.Role, models.Permission):
+                result = await db.execute(select(*model.__table__.columns))
+                tables.append(result.all())
+            self.snapshot = ReferenceSnapshot(version, *tables)  # swapped in whole, readers never see a partial load
+            self.loads = self.loads + 1
+            return self.snapshot
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        return {
+            "version": self.version,
+            "loaded_version": snapshot.version if snapshot is not None else None,
+            "loads": self.loads,
+            "regions": len(snapshot.regions) if snapshot is not None else 0,
+            "schools": len(snapshot.schools) if snapshot is not None else 0,
+            "programs": len(snapshot.programs) if snapshot is not None else 0,
+            "roles": len(snapshot.roles) if snapshot is not None else 0,
+            "permissions": len(snapshot.permissions) if snapshot is not None else 0,
+        }
+
+
+reference_data = ReferenceDataCache()
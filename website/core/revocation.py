@@ -0,0 +1,43 @@
+import heapq
+import time
+from typing import Iterable, Optional
+
+
+class DenyList:
+    def __init__(self):
+        self._expires: dict[str, float] = {}  # jti -> exp
+        self._heap: list[tuple[float, str]] = []  # (exp, jti), soonest first, so expired entries fall off the front
+
+    def add(
+            self,
+            jti: str,
+            expires_at: float,
+    ):
+        if expires_at <= time.time():
+            return
+        self._expires[jti] = expires_at
+        heapq.heappush(self._heap, (expires_at, jti))
+
+    def load(
+            self,
+            entries: Iterable[tuple[str, float]],
+    ):
+        for jti, expires_at in entries:
+            self.add(jti, expires_at)
+
+    def is_revoked(
+            self,
+            jti: Optional[str],
+    ) -> bool:
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, expired = heapq.heappop(self._heap)
+            if self._expires.get(expired) == expires_at:
+                del self._expires[expired]
+        return jti in self._expires
+
+    def stats(self) -> dict:
+        return {"size": len(self._expires)}
+
+
+deny_list = DenyList()
@@ -88,6 +88,7 @@ class UserPermissions(BaseModel):
 
 class Permission(BaseModel):
     name: str
+    bit: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -354,10 +355,38 @@ class TeamRoleAssociation(BaseModel):
         orm_mode = True
 
 
+class RefreshTokenCreate(BaseModel):
+    user_id: int
+    token_hash: str
+    created: datetime
+    expires: datetime
+
+
+class RevokedToken(BaseModel):
+    jti: str
+    expires: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class Principal(BaseModel):
+    id: int
+    email: str
+    scope_mask: int = 0
+    school_id: Optional[int] = None
+    jti: Optional[str] = None
+    exp: Optional[int] = None
+
+    class Config:
+        frozen = True
+
+
 class Token(BaseModel):
     iss: str  # issuer
     sub: str  # subject (email), must be unique
     iat: int  # utc unix time
     exp: int  # expires at utc unix time
     jti: str  # token identifier
-    scopes: list[str] = []  # permissions
+    scp: int = 0  # permission bitmask, see permission.bit
+    scopes: list[str] = []  # permission names, only in tokens issued before scp
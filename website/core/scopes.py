@@ -0,0 +1,52 @@
+from typing import Iterable, Optional
+
+
+class ScopeRegistry:
+    def __init__(self):
+        self.bits: dict[str, int] = {}  # permission name -> bit position, from the permission table
+
+    def load(
+            self,
+            permissions: Iterable[tuple[str, int]],
+    ):
+        self.bits = {name: bit for name, bit in permissions if bit is not None}
+
+    def add(
+            self,
+            name: str,
+            bit: int,
+    ):
+        self.bits = {**self.bits, name: bit}
+
+    def grant_mask(
+            self,
+            names: Iterable[str],
+    ) -> int:
+        mask = 0
+        for name in names:
+            bit = self.bits.get(name)
+            if bit is not None:
+                mask = mask | (1 << bit)
+        return mask
+
+    def required_mask(
+            self,
+            names: Iterable[str],
+    ) -> Optional[int]:
+        # None when a required scope has no bit, since no token can hold it
+        mask = 0
+        for name in names:
+            bit = self.bits.get(name)
+            if bit is None:
+                return None
+            mask = mask | (1 << bit)
+        return mask
+
+    def names(
+            self,
+            mask: int,
+    ) -> list[str]:
+        return [name for name, bit in self.bits.items() if mask & (1 << bit)]
+
+
+scope_registry = ScopeRegistry()
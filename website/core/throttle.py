@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+from website.core.config import LOGIN_EMAIL_BURST, LOGIN_EMAIL_REFILL_SECONDS, LOGIN_IP_BURST, LOGIN_IP_REFILL_SECONDS, LOGIN_THROTTLE_MAX_KEYS
+
+
+class TokenBucketLimiter:
+    def __init__(
+            self,
+            capacity: int,
+            refill_seconds: float,
+            max_keys: int,
+    ):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected = 0
+        self.refunded = 0
+        self._buckets: OrderedDict = OrderedDict()  # key -> (tokens, updated_at), least recently touched first
+
+    def take(
+            self,
+            key: Hashable,
+    ) -> float:
+        # returns 0 if a token was taken, otherwise the seconds until the next one
+        now = time.monotonic()
+        self._prune(now)
+        tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated_at) / self.refill_seconds)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.rejected = self.rejected + 1
+            return (1 - tokens) * self.refill_seconds
+        self._buckets[key] = (tokens - 1, now)
+        self.allowed = self.allowed + 1
+        return 0
+
+    def refund(
+            self,
+            key: Hashable,
+    ):
+        # gives back a token taken by take, for attempts that turned out not to count
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return
+        tokens, updated_at = bucket
+        self._buckets[key] = (min(self.capacity, tokens + 1), updated_at)
+        self.refunded = self.refunded + 1
+
+    def _prune(
+            self,
+            now: float,
+    ):
+        # a bucket untouched long enough to refill completely is the same as no bucket at all
+        full_after = self.capacity * self.refill_seconds
+        while self._buckets:
+            key, (tokens, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < full_after and len(self._buckets) < self.max_keys:
+                break
+            del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {"keys": len(self._buckets), "allowed": self.allowed, "rejected": self.rejected, "refunded": self.refunded}
+
+
+class LoginThrottle:
+    # tokens are taken before the password is checked, so concurrent guesses can't all get past an empty bucket,
+    # and given back once a login succeeds: only failed attempts count
+    def __init__(
+            self,
+            email_limiter: TokenBucketLimiter,
+            ip_limiter: TokenBucketLimiter,
+    ):
+        self.email_limiter = email_limiter
+        self.ip_limiter = ip_limiter
+        self._hashes_saved = 0  # every rejection, so an upper bound: attempts on unknown emails never reach bcrypt anyway
+
+    def take(
+            self,
+            email: str,
+            client_ip: str,
+    ) -> float:
+        retry_after = self.ip_limiter.take(client_ip)
+        if not retry_after:
+            retry_after = self.email_limiter.take(email.lower())
+            if retry_after:
+                self.ip_limiter.refund(client_ip)  # turned away before any hashing, so it isn't held against the address
+        if retry_after:
+            self._hashes_saved = self._hashes_saved + 1
+        return retry_after
+
+    def succeeded(
+            self,
+            email: str,
+            client_ip: str,
+    ):
+        self.ip_limiter.refund(client_ip)
+        self.email_limiter.refund(email.lower())
+
+    def stats(self) -> dict:
+        return {"email": self.email_limiter.stats(), "ip": self.ip_limiter.stats(), "hashes_saved": self._hashes_saved}
+
+
+login_throttle = LoginThrottle(TokenBucketLimiter(LOGIN_EMAIL_BURST, LOGIN_EMAIL_REFILL_SECONDS, LOGIN_THROTTLE_MAX_KEYS),
+                               TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_REFILL_SECONDS, LOGIN_THROTTLE_MAX_KEYS))
+
+
+def login_throttle_stats() -> dict:
+    return login_throttle.stats()
@@ -0,0 +1,142 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from website.core.config import WRITE_BATCH_DELAY_SECONDS, WRITE_BATCH_SIZE
+from website.core.database import async_session
+
+# a write operation adds to the session it is given and must not commit; the writer commits it
+WriteOperation = Callable[[AsyncSession], Awaitable]
+
+
+class WriteQueue:
+    def __init__(
+            self,
+            session_factory,
+            batch_size: int,
+            batch_delay: float,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.batches = 0
+        self.operations = 0
+        self.retried = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # operations already queued are still committed
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._queue = None
+        self._task = None
+
+    async def submit(
+            self,
+            operation: WriteOperation,
+    ):
+        if self._task is None:
+            # not started (scripts, maintenance), so commit on the caller's own session
+            async with self.session_factory() as db:
+                result = await operation(db)
+                await db.commit()
+                return result
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((operation, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(
+            self,
+            batch: list[tuple[WriteOperation, asyncio.Future]],
+    ):
+        self.batches = self.batches + 1
+        self.operations = self.operations + len(batch)
+        if len(batch) == 1:
+            await self._commit_one(*batch[0])
+            return
+        try:
+            async with self.session_factory() as db:
+                results = [await operation(db) for operation, future in batch]
+                await db.commit()
+        except Exception:
+            # one bad operation shouldn't fail the rest, so each is retried in its own transaction
+            self.retried = self.retried + len(batch)
+            for item in batch:
+                await self._commit_one(*item)
+            return
+        for (operation, future), result in zip(batch, results):
+            self._resolve(future, result=result)
+
+    async def _commit_one(
+            self,
+            operation: WriteOperation,
+            future: asyncio.Future,
+    ):
+        try:
+            async with self.session_factory() as db:
+                result = await operation(db)
+                await db.commit()
+        except Exception as e:
+            self._resolve(future, exception=e)
+        else:
+            self._resolve(future, result=result)
+
+    def _resolve(
+            self,
+            future: asyncio.Future,
+            result=None,
+            exception: Optional[BaseException] = None,
+    ):
+        if future.done():  # the caller went away
+            return
+        if exception is not None:
+            self.failed = self.failed + 1
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "operations": self.operations,
+            "avg_batch_size": round(self.operations / self.batches, 2) if self.batches else 0,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+write_queue = WriteQueue(async_session, WRITE_BATCH_SIZE, WRITE_BATCH_DELAY_SECONDS)
@@ -1,6 +1,12 @@
-import asyncio
+import calendar
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
 
 from website.api.user import user
@@ -11,7 +17,17 @@ from website.api.training import training
 from website.api.views import views
 from website.api.school import school
 from website.api.program import program
-from website.core.database import init_database
+from website.core import crud
+from website.core.cache import principal_cache
+from website.core.config import DEBUG
+from website.core.database import engine, get_sqlite_settings, init_database, async_session, query_count, read_session, warm_connections
+from website.core.invalidation import cache_bus, create_backend
+from website.core.jobs import start_periodic_jobs, stop_periodic_jobs
+from website.core.passwords import password_hasher
+from website.core.refdata import reference_data
+from website.core.revocation import deny_list
+from website.core.scopes import scope_registry
+from website.core.writer import write_queue
 
 app = FastAPI()
 
@@ -25,6 +41,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Query-Count"],
 )
 
 app.include_router(auth, tags=["auth"])
@@ -35,3 +52,119 @@ app.include_router(data, tags=["data"])
 app.include_router(training, tags=["training"])
 app.include_router(user, tags=["user"])
 app.include_router(views, tags=["views"])
+
+
+@app.middleware("http")
+async def count_queries(request: Request, call_next):
+    if not DEBUG:
+        return await call_next(request)
+    count = [0]
+    query_count.set(count)
+    response = await call_next(request)
+    response.headers["X-Query-Count"] = str(count[0])
+    return response
+
+
+@app.exception_handler(crud.InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: crud.InvalidCursor):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        content={"detail": json.dumps({"cursor": "This cursor is not valid"})}
+    )
+
+
+async def load_scopes(
+        db: AsyncSession,
+):
+    scope_registry.load((permission.name, permission.bit) for permission in await crud.get_permissions(db))
+
+
+async def load_deny_list(
+        db: AsyncSession,
+):
+    deny_list.load((token.jti, calendar.timegm(token.expires.utctimetuple())) for token in await crud.get_active_revoked_tokens(db))
+
+
+# what another worker's writes mean for this worker's caches, key None when it may have missed some
+def on_principal_changed(key: Optional[str]):
+    if key is None:
+        principal_cache.clear()
+    else:
+        principal_cache.invalidate_owner(int(key))
+
+
+async def on_token_revoked(key: Optional[str]):
+    if key is None:
+        async with read_session() as db:
+            await load_deny_list(db)
+        return
+    jti, expires_at = key.rsplit(' ', 1)
+    deny_list.add(jti, float(expires_at))
+    principal_cache.invalidate(jti)
+
+
+async def on_permission_created(key: Optional[str]):
+    reference_data.invalidate()
+    if key is None:
+        async with read_session() as db:
+            await load_scopes(db)
+        return
+    name, bit = key.rsplit(' ', 1)
+    scope_registry.add(name, int(bit))
+
+
+def on_reference_data_changed(key: Optional[str]):
+    reference_data.invalidate()
+
+
+cache_bus.subscribe('principal', on_principal_changed)
+cache_bus.subscribe('revoked', on_token_revoked)
+cache_bus.subscribe('permission', on_permission_created)
+cache_bus.subscribe('refdata', on_reference_data_changed)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    app.state.ready = False
+    await init_database()
+    print("SQLite settings: " + ", ".join(f"{name}={value}" for name, value in (await get_sqlite_settings(engine)).items()))
+    await warm_connections()
+    # started before the caches load, so anything another worker changes while they load is applied after
+    await cache_bus.start(create_backend(async_session, read_session))
+    async with async_session() as db:
+        await crud.assign_permission_bits(db)
+        await load_scopes(db)
+        await reference_data.get(db)
+        await crud.delete_expired_revoked_tokens(db)
+        await load_deny_list(db)
+        top_volunteers, next_cursor = await crud.get_top_volunteers(db, 1)
+        if not top_volunteers:
+            await crud.rebuild_leaderboard_snapshot(db)
+        if not await crud.get_stat_counter(db, 'record_count'):
+            await crud.reconcile_stat_counters(db)
+        if not await crud.has_hours_rollup(db):
+            await crud.rebuild_hours_rollup(db)
+    write_queue.start()
+    periodic_jobs = start_periodic_jobs()
+    app.state.startup_seconds = round(time.perf_counter() - started, 3)
+    app.state.ready = True
+    print(f"Started in {app.state.startup_seconds:.2f}s")
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await stop_periodic_jobs(periodic_jobs)
+        await write_queue.stop()
+        await cache_bus.stop()
+        password_hasher.shutdown()
+
+
+app.router.lifespan_context = lifespan
+
+
+@app.get("/api/ready")
+async def ready():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False})
+    return {"ready": True, "startup_seconds": app.state.startup_seconds}
@@ -0,0 +1,31 @@
+import argparse
+import asyncio
+import time
+
+from website.core import crud
+from website.core.database import async_session, init_models, startup_lock
+
+COMMANDS = {
+    'archive-volunteer-records': crud.archive_volunteer_records,
+    'rebuild-hours-summary': crud.rebuild_user_hours_summary,
+    'rebuild-hours-rollup': crud.rebuild_hours_rollup,
+    'rebuild-leaderboard': crud.rebuild_leaderboard_snapshot,
+    'reconcile-stat-counters': crud.reconcile_stat_counters,
+}
+
+
+async def run(
+        command: str,
+):
+    async with startup_lock() as conn:
+        await init_models(conn)
+    async with async_session() as db:
+        started = time.perf_counter()
+        await COMMANDS[command](db)
+        print(f"{command} finished in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintenance tasks for the volunteer portal database")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    asyncio.run(run(parser.parse_args().command))